@@ -8,25 +8,55 @@ chess coach system and returning results as JSON responses.
 
 import sys
 import os
+import asyncio
+import hashlib
 import tempfile
-from fastapi import FastAPI, UploadFile, File, Depends, HTTPException
-from fastapi.responses import JSONResponse
-from shutil import copyfileobj
+import threading
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, UploadFile, File, Depends, HTTPException
+from fastapi.responses import ORJSONResponse
 from typing import List, Dict, Any
 
 # Add the project root to the Python path to allow importing from parent
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from database import Database
-from core.analysis import StockfishAnalyzer, LLMCoach, GameProcessor
-
-app = FastAPI(title="Chess Coach API", description="API for analyzing chess games and providing coaching feedback")
+from core.analysis import StockfishPool, CachedAnalyzer, LLMCoach, CachedCoach, GameProcessor
 
 # --- Constants ---
 STOCKFISH_PATH = os.getenv("STOCKFISH_PATH", "stockfish")
 BLUNDER_THRESHOLD = 150  # Minimum centipawn loss to be considered a significant mistake
+STOCKFISH_WORKERS = int(os.getenv("STOCKFISH_WORKERS", 0)) or None  # Engine processes searching in parallel; default: half the CPUs
+STOCKFISH_NODES = 500_000  # Node budget per full-depth search
+STOCKFISH_HASH_MB = int(os.getenv("STOCKFISH_HASH_MB", 256))  # Transposition table size of each engine process
+SCREEN_DEPTH = int(os.getenv("SCREEN_DEPTH", 10)) or None  # Depth of the quick pass; only suspected mistakes are searched at full depth, 0 disables it
+OPENING_BOOK_PATH = os.getenv("OPENING_BOOK_PATH")  # Optional Polyglot book; book moves are not searched
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "gemma3:1b")  # The Ollama model to use for analysis
+OLLAMA_NUM_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", 4))  # Concurrent LLM requests; match the Ollama server setting
 SYSTEM_PROMPT_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "prompts", "system_prompt.txt")
+UPLOAD_CHUNK_SIZE = 1 << 20  # Uploads are written to disk 1 MiB at a time
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Starts the Stockfish pool and the LLM coach once for the lifetime of the app.
+    
+    Requests share the warm engine processes and their hash tables instead of
+    spawning new ones per upload; the engines are shut down with the app.
+    """
+    app.state.engine_pool = StockfishPool(stockfish_path=STOCKFISH_PATH, size=STOCKFISH_WORKERS,
+                                          hash_mb=STOCKFISH_HASH_MB, nodes=STOCKFISH_NODES)
+    app.state.coach = LLMCoach(model=OLLAMA_MODEL, system_prompt_path=SYSTEM_PROMPT_PATH,
+                               max_parallel=OLLAMA_NUM_PARALLEL)
+    # Load the model in the background, so the first upload does not wait for it
+    threading.Thread(target=app.state.coach.warm_up, daemon=True).start()
+    try:
+        yield
+    finally:
+        app.state.engine_pool.close()
+
+app = FastAPI(title="Chess Coach API", description="API for analyzing chess games and providing coaching feedback",
+              default_response_class=ORJSONResponse, lifespan=lifespan)
 
 def get_db():
     """
@@ -40,6 +70,28 @@ def get_db():
     finally:
         db.close()
 
+def run_analysis(pgn_path: str, pgn_id: str, db: Database, engine_pool: StockfishPool,
+                 coach: LLMCoach) -> List[Dict[str, Any]]:
+    """
+    Runs the blocking analysis pipeline on a PGN file and returns the detected blunders.
+    
+    The blunders are stored under pgn_id, replacing those of an earlier upload
+    of the same game. Stockfish, Ollama and SQLite calls all block, so the
+    endpoint runs this in a worker thread to keep the event loop free for
+    concurrent requests.
+    """
+    # The shared pool outlives the request, so the cache wrapper is not closed
+    analyzer = CachedAnalyzer(engine_pool, db)
+    processor = GameProcessor(analyzer, CachedCoach(coach, db), db, BLUNDER_THRESHOLD, screen_depth=SCREEN_DEPTH,
+                              llm_workers=OLLAMA_NUM_PARALLEL, opening_book_path=OPENING_BOOK_PATH)
+    
+    # Analyze the game
+    db.delete_blunders_by_pgn_path(pgn_id)
+    processor.analyze_game(pgn_path, side_to_analyze='both', pgn_id=pgn_id)
+    
+    # Get the analysis results from the database
+    return db.get_blunders_by_pgn_path(pgn_id)
+
 @app.get("/")
 def read_root():
     """
@@ -49,6 +101,7 @@ def read_root():
 
 @app.post("/analyze/", response_model=Dict[str, List[Dict[str, Any]]])
 async def analyze_pgn_file(
+    request: Request,
     pgn_file: UploadFile = File(..., description="A PGN file to be analyzed."),
     db: Database = Depends(get_db)
 ):
@@ -56,23 +109,19 @@ async def analyze_pgn_file(
     Analyzes a PGN file and returns a list of detected blunders with coaching comments.
     """
     # Create a temporary file to store the uploaded PGN
+    digest = hashlib.blake2b(digest_size=16)
     with tempfile.NamedTemporaryFile(delete=False, suffix='.pgn', mode='wb') as tmp_file:
-        # Copy the uploaded file to the temp file
-        copyfileobj(pgn_file.file, tmp_file)
+        # Stream the upload in chunks so large multi-game PGN dumps are never held in memory whole
+        while chunk := await pgn_file.read(UPLOAD_CHUNK_SIZE):
+            tmp_file.write(chunk)
+            digest.update(chunk)
         tmp_path = tmp_file.name
+    # Results are keyed by the content, like analyze_pgn_string, not by the temporary path
+    pgn_id = digest.hexdigest()
     
     try:
-        # Initialize components
-        analyzer = StockfishAnalyzer(stockfish_path=STOCKFISH_PATH)
-        coach = LLMCoach(model=OLLAMA_MODEL, system_prompt_path=SYSTEM_PROMPT_PATH)
-        processor = GameProcessor(analyzer, coach, db, BLUNDER_THRESHOLD)
-        
-        # Analyze the game
-        processor.analyze_game(tmp_path, side_to_analyze='both')
-        
-        # Get the analysis results from the database
-        analysis_results = db.get_blunders_by_pgn_path(tmp_path)
-        
+        analysis_results = await asyncio.to_thread(run_analysis, tmp_path, pgn_id, db,
+                                                   request.app.state.engine_pool, request.app.state.coach)
         return {"analysis": analysis_results}
     
     except FileNotFoundError as e:
@@ -82,6 +131,4 @@ async def analyze_pgn_file(
     finally:
         # Clean up the temporary file
         if os.path.exists(tmp_path):
-            os.remove(tmp_path)
-        if 'analyzer' in locals():
-            analyzer.close()
\ No newline at end of file
+            os.remove(tmp_path)
\ No newline at end of file
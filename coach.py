@@ -7,46 +7,114 @@ and LLM-based coaching to help players improve their game.
 """
 
 import os
+import io
+import atexit
+import logging
 import argparse
+import hashlib
+import threading
 import chess.pgn
-import tempfile
 from pathlib import Path
+from typing import List, Optional, Tuple
 from database import Database
-from core.analysis import StockfishAnalyzer, LLMCoach, GameProcessor
+from core.analysis import StockfishPool, CachedAnalyzer, LLMCoach, CachedCoach, GameProcessor
 
 # --- Constants ---
 STOCKFISH_PATH = os.getenv("STOCKFISH_PATH", "D:/stockfish/stockfish-windows-x86-64-avx2.exe")
 
 BLUNDER_THRESHOLD = 150  # Minimum centipawn loss to be considered a significant mistake
+STOCKFISH_WORKERS = int(os.getenv("STOCKFISH_WORKERS", 0)) or None  # Engine processes searching in parallel; default: half the CPUs
+STOCKFISH_NODES = 500_000  # Node budget per full-depth search
+STOCKFISH_HASH_MB = int(os.getenv("STOCKFISH_HASH_MB", 256))  # Transposition table size of each engine process
+SCREEN_DEPTH = int(os.getenv("SCREEN_DEPTH", 10)) or None  # Depth of the quick pass; only suspected mistakes are searched at full depth, 0 disables it
+OPENING_BOOK_PATH = os.getenv("OPENING_BOOK_PATH")  # Optional Polyglot book; book moves are not searched
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "gemma3:1b")  # The Ollama model to use for analysis
+OLLAMA_NUM_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", 4))  # Concurrent LLM requests; match the Ollama server setting
 SYSTEM_PROMPT_PATH = os.path.join(os.path.dirname(__file__), "prompts", "system_prompt.txt")
 
+# Engines and coach shared by every analyze_pgn_string call, started on first use
+_shared_engines: Optional[Tuple[StockfishPool, LLMCoach]] = None
+_shared_engines_lock = threading.Lock()
+
+def _get_shared_engines() -> Tuple[StockfishPool, LLMCoach]:
+    """
+    Returns the shared Stockfish pool and LLM coach, starting them on first use.
+    
+    Keeping the engine processes alive between calls avoids reloading the NNUE
+    network and reallocating the hash tables for every game. The pool is shut
+    down when the interpreter exits.
+    """
+    global _shared_engines
+    with _shared_engines_lock:
+        if _shared_engines is None:
+            engine_pool = StockfishPool(stockfish_path=STOCKFISH_PATH, size=STOCKFISH_WORKERS,
+                                        hash_mb=STOCKFISH_HASH_MB, nodes=STOCKFISH_NODES)
+            atexit.register(engine_pool.close)
+            coach = LLMCoach(model=OLLAMA_MODEL, system_prompt_path=SYSTEM_PROMPT_PATH,
+                             max_parallel=OLLAMA_NUM_PARALLEL)
+            # Load the model while Stockfish searches the first game
+            threading.Thread(target=coach.warm_up, daemon=True).start()
+            _shared_engines = (engine_pool, coach)
+        return _shared_engines
+
+def _expand_pgn_paths(paths: List[str]) -> List[str]:
+    """Replaces each directory among the given paths with the PGN files it contains."""
+    expanded = []
+    for path in paths:
+        if os.path.isdir(path):
+            expanded.extend(str(pgn) for pgn in sorted(Path(path).glob("*.pgn")))
+        else:
+            expanded.append(path)
+    return expanded
+
 def main():
     """Main function to run the analysis from the command line."""
     parser = argparse.ArgumentParser(description="Analyzes a chess game to identify blunders and provide coaching feedback.")
-    parser.add_argument("pgn_file", help="Path to the PGN file to analyze.")
+    parser.add_argument("pgn_files", nargs='+', metavar="pgn_file",
+                       help="PGN files, or directories of them, to analyze with the same engines.")
     parser.add_argument("--side", choices=['white', 'black', 'both'], default='both', 
                        help="The side to analyze (white, black, or both). Default is both.")
-    parser.add_argument("--output", help="Optional path to save the annotated PGN file.")
+    parser.add_argument("--output", help="Optional path to save the annotated games to, as one PGN file.")
+    parser.add_argument("--book", default=OPENING_BOOK_PATH,
+                       help="Optional Polyglot opening book; moves played from it are not searched.")
     args = parser.parse_args()
 
+    # Show the analysis progress on the console, but not the INFO records of other libraries
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    analysis_logger = logging.getLogger("core.analysis")
+    analysis_logger.addHandler(handler)
+    analysis_logger.setLevel(logging.INFO)
+
     # Initialize components
     db = Database()
+    db.init_db()
     
     try:
-        analyzer = StockfishAnalyzer(stockfish_path=STOCKFISH_PATH)
-        coach = LLMCoach(model=OLLAMA_MODEL, system_prompt_path=SYSTEM_PROMPT_PATH)
-        processor = GameProcessor(analyzer, coach, db, BLUNDER_THRESHOLD)
+        analyzer = CachedAnalyzer(StockfishPool(stockfish_path=STOCKFISH_PATH, size=STOCKFISH_WORKERS,
+                                                hash_mb=STOCKFISH_HASH_MB, nodes=STOCKFISH_NODES), db)
+        coach = CachedCoach(LLMCoach(model=OLLAMA_MODEL, system_prompt_path=SYSTEM_PROMPT_PATH,
+                                     max_parallel=OLLAMA_NUM_PARALLEL), db)
+        # Load the model while Stockfish searches the first game
+        threading.Thread(target=coach.warm_up, daemon=True).start()
+        processor = GameProcessor(analyzer, coach, db, BLUNDER_THRESHOLD, screen_depth=SCREEN_DEPTH,
+                                  llm_workers=OLLAMA_NUM_PARALLEL, opening_book_path=args.book)
         
-        # Analyze the game and get the annotated version
-        annotated_game = processor.analyze_game(args.pgn_file, args.side)
+        # Analyze every game on the same engines, so their startup is paid once
+        annotated_games = []
+        for pgn_file in _expand_pgn_paths(args.pgn_files):
+            try:
+                annotated_games.append(processor.analyze_game(pgn_file, args.side))
+            except (FileNotFoundError, ValueError) as e:
+                print(f"Error: {e}")
 
-        # Export the annotated game if requested
-        if args.output:
+        # Export the annotated games if requested
+        if args.output and annotated_games:
             with open(args.output, "w", encoding="utf-8") as f:
                 exporter = chess.pgn.FileExporter(f)
-                annotated_game.accept(exporter)
-            print(f"\nAnnotated game saved to {args.output}")
+                for annotated_game in annotated_games:
+                    annotated_game.accept(exporter)
+            print(f"\nAnnotated games saved to {args.output}")
 
     except FileNotFoundError as e:
         print(f"Error: {e}")
@@ -60,7 +128,10 @@ def main():
 
 def analyze_pgn_string(pgn_content: str) -> list:
     """
-    Analyzes a PGN string by saving it to a temporary file and running the analysis.
+    Analyzes a PGN string in memory and returns the detected blunders.
+    
+    The results are stored under a hash of the PGN content, so analyzing the same
+    game again replaces its earlier results instead of adding to them.
     
     Args:
         pgn_content: A string containing the PGN data.
@@ -68,33 +139,29 @@ def analyze_pgn_string(pgn_content: str) -> list:
     Returns:
         A list of dictionaries, where each dictionary represents a blunder.
     """
-    # Create a temporary file to store the PGN content
-    with tempfile.NamedTemporaryFile(mode='w+', delete=False, suffix='.pgn', encoding='utf-8') as tmp_file:
-        tmp_file.write(pgn_content)
-        tmp_file_path = tmp_file.name
+    pgn_id = hashlib.blake2b(pgn_content.encode('utf-8'), digest_size=16).hexdigest()
 
     try:
-        # Initialize components
+        # Initialize components; the engines are shared and stay open after the call
         db = Database()
-        analyzer = StockfishAnalyzer(stockfish_path=STOCKFISH_PATH)
-        coach = LLMCoach(model=OLLAMA_MODEL, system_prompt_path=SYSTEM_PROMPT_PATH)
-        processor = GameProcessor(analyzer, coach, db, BLUNDER_THRESHOLD)
+        db.init_db()
+        engine_pool, coach = _get_shared_engines()
+        analyzer = CachedAnalyzer(engine_pool, db)
+        processor = GameProcessor(analyzer, CachedCoach(coach, db), db, BLUNDER_THRESHOLD, screen_depth=SCREEN_DEPTH,
+                                  llm_workers=OLLAMA_NUM_PARALLEL, opening_book_path=OPENING_BOOK_PATH)
         
-        # Analyze the game
-        processor.analyze_game(tmp_file_path)
+        # Analyze the game straight from memory
+        db.delete_blunders_by_pgn_path(pgn_id)
+        processor.analyze_game_from_stream(io.StringIO(pgn_content), pgn_id)
         
         # Retrieve the results from the database
-        results = db.get_blunders_by_pgn_path(tmp_file_path)
+        results = db.get_blunders_by_pgn_path(pgn_id)
         return results
         
     finally:
         # Clean up resources
         if 'db' in locals():
             db.close()
-        if 'analyzer' in locals():
-            analyzer.close()
-        if os.path.exists(tmp_file_path):
-            os.remove(tmp_file_path)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -6,29 +6,86 @@ and generate helpful coaching feedback using Stockfish and LLM-based analysis.
 """
 
 import os
-import json
+import queue
+import hashlib
+import logging
+import itertools
+import threading
 import chess
 import chess.pgn
+import chess.engine
+import chess.polyglot
 import ollama
-from stockfish import Stockfish
-from typing import Dict, List, Optional, Tuple, Union, Any
+import orjson
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union, Any, TextIO, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from database import Database
+
+logger = logging.getLogger(__name__)
+
+_REQUEST_TIMEOUT = 60  # Seconds an Ollama request may take
+
+# Ollama options of every coaching request. The warm-up must send the same
+# ones, since a different context size makes the server reload the model.
+_CHAT_OPTIONS = {
+    'temperature': 0,  # Deterministic replies, so a cached answer is the one the model would give again
+    'num_ctx': 2048,  # The prompts are short; a small context loads and evaluates faster
+    'num_predict': 256  # A coaching explanation never needs more tokens
+}
+
+# JSON schema the coaching reply is constrained to; the choices match the system prompt
+_COACHING_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'motif': {'type': 'string', 'enum': [
+            'Pin', 'Skewer', 'Fork', 'DiscoveredAttack', 'XRay', 'Zwischenzug', 'Overloading', 'Clearance',
+            'Interference', 'HangingPiece', 'Deflection', 'BackRankWeakness', 'Reloader', 'None'
+        ]},
+        'severity': {'type': 'string', 'enum': ['Inaccuracy', 'PositionalError', 'MissedTactic', 'Blunder', 'MissedMate']},
+        'explanation': {'type': 'string'}
+    },
+    'required': ['motif', 'severity', 'explanation']
+}
+
+# The user message of a coaching request, filled in for each mistake
+_USER_PROMPT_TEMPLATE = """\
+──────────────────── ANALYSIS CONTEXT ────────────────────
+- FEN Before Move: {position_fen}
+- Player's Move: {move_san}
+- Engine's Best Move: {best_move_san}
+- Centipawn Loss: {cp_loss}
+- Was a forced mate missed? {mate_missed}
+"""
 
 
 class StockfishAnalyzer:
     """
     Handles all interactions with the Stockfish chess engine.
     
-    This class encapsulates Stockfish initialization, position evaluation,
-    and best move calculation to provide a clean interface for chess analysis.
+    This class keeps a single long-lived UCI engine process open for the whole
+    analysis, so the engine's hash table stays warm across positions, and
+    exposes position evaluation and best move calculation.
     """
     
-    def __init__(self, stockfish_path: str, depth: int = 18):
+    MATE_SCORE = 30000  # Centipawn value standing in for a forced mate
+    
+    def __init__(self, stockfish_path: str, depth: int = 18,
+                 threads: Optional[int] = None, hash_mb: int = 2048,
+                 nodes: Optional[int] = None):
         """
         Initialize the StockfishAnalyzer.
         
         Args:
             stockfish_path: Path to the Stockfish executable.
             depth: Search depth for Stockfish analysis.
+            threads: Number of search threads. Defaults to the CPU count.
+            hash_mb: Size of the engine's transposition table in megabytes.
+            nodes: Optional node budget per search. The search stops at whichever
+                of the depth or the node budget is reached first, which keeps the
+                time per position roughly constant.
         
         Raises:
             FileNotFoundError: If the Stockfish executable is not found.
@@ -36,20 +93,69 @@ class StockfishAnalyzer:
         if not os.path.exists(stockfish_path) or not os.path.isfile(stockfish_path):
             raise FileNotFoundError(f"Stockfish executable not found at: {stockfish_path}")
             
-        self.stockfish = Stockfish(path=stockfish_path, depth=depth)
+        self.depth = depth
+        self.nodes = nodes
+        self.engine = chess.engine.SimpleEngine.popen_uci(stockfish_path)
+        self.engine.configure({"Hash": hash_mb, "Threads": threads or os.cpu_count() or 1})
     
-    def get_stockfish_evaluation(self, board: chess.Board) -> Dict[str, Any]:
+    @property
+    def engine_name(self) -> str:
+        """The name and version the engine reported, e.g. 'Stockfish 16.1'."""
+        return self.engine.id.get("name", "unknown")
+    
+    def _limit(self, depth: Optional[int] = None) -> chess.engine.Limit:
+        """Build the search limit, optionally overriding the configured depth."""
+        return chess.engine.Limit(depth=depth or self.depth, nodes=self.nodes)
+    
+    def get_stockfish_evaluation(self, board: chess.Board, depth: Optional[int] = None) -> Dict[str, Any]:
         """
         Gets the Stockfish evaluation for a given board position.
         
+        The principal variation is requested in the same search, so the
+        engine's best move comes for free with every evaluation.
+        
         Args:
             board: A chess.Board object representing the position.
+            depth: Optional search depth overriding the configured one.
             
         Returns:
-            The evaluation dictionary, e.g., {'type': 'cp', 'value': 21}.
+            The evaluation dictionary from White's perspective, e.g.
+            {'type': 'cp', 'value': 21, 'best_move': 'e2e4', 'depth': 18}.
+            The depth is the one the search reached, which is lower than the
+            requested one when the node budget ran out first.
         """
-        self.stockfish.set_fen_position(board.fen())
-        return self.stockfish.get_evaluation()
+        info = self.engine.analyse(
+            board,
+            self._limit(depth),
+            info=chess.engine.INFO_SCORE | chess.engine.INFO_PV
+        )
+        score = info["score"].white()
+        pv = info.get("pv")
+        
+        if score.is_mate() and score.mate() == 0:
+            # Mate is already on the board; "mate 0" carries no sign, so keep the winner's value
+            evaluation = {'type': 'cp', 'value': score.score(mate_score=self.MATE_SCORE)}
+        elif score.is_mate():
+            evaluation = {'type': 'mate', 'value': score.mate()}
+        else:
+            evaluation = {'type': 'cp', 'value': score.score()}
+        evaluation['best_move'] = pv[0].uci() if pv else None
+        evaluation['depth'] = info.get('depth')
+        return evaluation
+    
+    def evaluate_positions(self, boards: List[chess.Board],
+                           depth: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Evaluates a sequence of positions one after another on this engine.
+        
+        Args:
+            boards: The positions to evaluate.
+            depth: Optional search depth overriding the configured one.
+            
+        Returns:
+            The evaluation dictionaries, in the same order as the boards.
+        """
+        return [self.get_stockfish_evaluation(board, depth) for board in boards]
     
     def get_best_move(self, board: chess.Board) -> str:
         """
@@ -61,8 +167,8 @@ class StockfishAnalyzer:
         Returns:
             The best move in UCI format (e.g., 'e2e4').
         """
-        self.stockfish.set_fen_position(board.fen())
-        return self.stockfish.get_best_move()
+        result = self.engine.play(board, self._limit())
+        return result.move.uci()
     
     @staticmethod
     def get_centipawns(evaluation: Dict[str, Any]) -> Optional[int]:
@@ -83,15 +189,264 @@ class StockfishAnalyzer:
         elif evaluation['type'] == 'mate':
             # A mate score is converted to a large centipawn value
             # The sign indicates who is winning
-            mate_score = 30000  # Large value to represent mate
+            mate_score = StockfishAnalyzer.MATE_SCORE
             return -mate_score if evaluation['value'] < 0 else mate_score
         return None
     
     def close(self):
-        """Clean up resources used by the Stockfish engine."""
-        # The stockfish library doesn't expose a direct close method,
-        # but we include this for future compatibility and clean design
-        pass
+        """Shut down the Stockfish engine process."""
+        self.engine.quit()
+
+
+class StockfishPool:
+    """
+    A fixed pool of Stockfish engines.
+    
+    Independent positions are searched concurrently, one per engine process,
+    which scales better than giving a single engine several threads. Engines
+    only get more than one thread when the pool has fewer engines than cores. The pool
+    exposes the same interface as StockfishAnalyzer and can be used in its place.
+    """
+    
+    RUNS_PER_ENGINE = 4  # A batch is split into this many runs per engine to balance the load
+    
+    def __init__(self, stockfish_path: str, size: Optional[int] = None,
+                 depth: int = 18, hash_mb: int = 256, nodes: Optional[int] = None,
+                 threads: Optional[int] = None):
+        """
+        Start the engine processes.
+        
+        Args:
+            stockfish_path: Path to the Stockfish executable.
+            size: Number of engine processes. Defaults to half the logical CPU
+                count, i.e. one engine per physical core on SMT machines, since
+                a second search on a hyperthread sibling adds little and the
+                LLM server needs CPU time too.
+            depth: Search depth for Stockfish analysis.
+            hash_mb: Size of each engine's transposition table in megabytes.
+            nodes: Optional node budget per search, see StockfishAnalyzer.
+            threads: Search threads of each engine. Defaults to sharing the same
+                core budget among the engines, so the default pool runs
+                single-threaded engines and a pool of one engine searches with
+                a thread per physical core.
+        
+        Raises:
+            FileNotFoundError: If the Stockfish executable is not found.
+        """
+        cores = max(1, (os.cpu_count() or 1) // 2)
+        self.size = size or cores
+        self.threads = threads or max(1, cores // self.size)
+        self.depth = depth
+        self.nodes = nodes
+        self._analyzers: List[StockfishAnalyzer] = []
+        try:
+            for _ in range(self.size):
+                self._analyzers.append(StockfishAnalyzer(stockfish_path, depth=depth, threads=self.threads,
+                                                         hash_mb=hash_mb, nodes=nodes))
+        except Exception:
+            self.close()
+            raise
+        
+        # Engines waiting for work; a caller borrows one for the duration of a search
+        self._idle: "queue.Queue[StockfishAnalyzer]" = queue.Queue()
+        for analyzer in self._analyzers:
+            self._idle.put(analyzer)
+        self._executor = ThreadPoolExecutor(max_workers=self.size)
+    
+    def get_stockfish_evaluation(self, board: chess.Board, depth: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Evaluates a position on the next idle engine.
+        
+        Args:
+            board: A chess.Board object representing the position.
+            depth: Optional search depth overriding the configured one.
+            
+        Returns:
+            The evaluation dictionary, see StockfishAnalyzer.get_stockfish_evaluation.
+        """
+        analyzer = self._idle.get()
+        try:
+            return analyzer.get_stockfish_evaluation(board, depth)
+        finally:
+            self._idle.put(analyzer)
+    
+    def evaluate_positions(self, boards: List[chess.Board],
+                           depth: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Evaluates a sequence of positions in parallel across the pool.
+        
+        The sequence is split into a few contiguous runs per engine, so consecutive
+        positions of a game are searched by the same engine and hit the entries
+        its transposition table kept from the previous ply. An engine that
+        finishes its run takes the next one, so a run of sharp, slow positions
+        does not leave the other engines idle until it is done.
+        
+        Args:
+            boards: The positions to evaluate.
+            depth: Optional search depth overriding the configured one.
+            
+        Returns:
+            The evaluation dictionaries, in the same order as the boards.
+        """
+        run_length = max(1, -(-len(boards) // (self.size * self.RUNS_PER_ENGINE)))
+        runs = [boards[i:i + run_length] for i in range(0, len(boards), run_length)]
+        results = self._executor.map(lambda run: self._evaluate_run(run, depth), runs)
+        return [evaluation for run in results for evaluation in run]
+    
+    def _evaluate_run(self, boards: List[chess.Board], depth: Optional[int]) -> List[Dict[str, Any]]:
+        """Evaluates a run of positions one after another on a single idle engine."""
+        analyzer = self._idle.get()
+        try:
+            return [analyzer.get_stockfish_evaluation(board, depth) for board in boards]
+        finally:
+            self._idle.put(analyzer)
+    
+    def get_best_move(self, board: chess.Board) -> str:
+        """
+        Gets the best move in UCI format from the next idle engine.
+        
+        Args:
+            board: A chess.Board object representing the position.
+            
+        Returns:
+            The best move in UCI format (e.g., 'e2e4').
+        """
+        analyzer = self._idle.get()
+        try:
+            return analyzer.get_best_move(board)
+        finally:
+            self._idle.put(analyzer)
+    
+    @property
+    def engine_name(self) -> str:
+        """The name and version the engines reported, e.g. 'Stockfish 16.1'."""
+        return self._analyzers[0].engine_name
+    
+    get_centipawns = staticmethod(StockfishAnalyzer.get_centipawns)
+    
+    def close(self):
+        """Shut down every engine process in the pool."""
+        if hasattr(self, '_executor'):
+            self._executor.shutdown(wait=True)
+        for analyzer in self._analyzers:
+            analyzer.close()
+
+
+class CachedAnalyzer:
+    """
+    Wraps an analyzer with a persistent evaluation cache.
+    
+    Evaluations are stored in the database keyed by the position's Zobrist hash
+    and the engine version, so positions seen in earlier games or requests are
+    answered without a search. A cached entry is used when its search reached
+    the requested depth, or was limited to at least that depth with a node
+    budget no smaller than the wrapped analyzer's. A search cut short by a
+    smaller node budget does not count as a deep one.
+    
+    Positions already looked up by this instance are also kept in memory, keyed
+    by python-chess's transposition key, so repeated lookups skip both the
+    Zobrist hash and the database query. When the memo is full the least
+    recently used position is dropped, so the opening positions shared by
+    many games of a batch stay in memory.
+    
+    Neither key covers the moves that led to a position, so cache misses are
+    searched from the bare FEN, without the game's history.
+    """
+    
+    MEMO_SIZE = 100_000  # Positions kept in memory
+    
+    def __init__(self, analyzer: Union[StockfishAnalyzer, StockfishPool], db: 'Database'):
+        """
+        Initialize the cache.
+        
+        Args:
+            analyzer: The StockfishAnalyzer or StockfishPool to search cache misses with.
+            db: A Database instance holding the evaluation cache.
+        """
+        self.analyzer = analyzer
+        self.db = db
+        self.depth = analyzer.depth
+        self.nodes = analyzer.nodes
+        self._memo = OrderedDict()  # transposition key -> (depth, evaluation), least recently used first
+    
+    def get_stockfish_evaluation(self, board: chess.Board, depth: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Gets the evaluation for a position from the cache, searching on a miss.
+        
+        Args:
+            board: A chess.Board object representing the position.
+            depth: Optional search depth overriding the configured one.
+            
+        Returns:
+            The evaluation dictionary, see StockfishAnalyzer.get_stockfish_evaluation.
+        """
+        return self.evaluate_positions([board], depth)[0]
+    
+    def evaluate_positions(self, boards: List[chess.Board],
+                           depth: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Evaluates a sequence of positions, searching only those not in the cache.
+        
+        Args:
+            boards: The positions to evaluate.
+            depth: Optional search depth overriding the configured one.
+            
+        Returns:
+            The evaluation dictionaries, in the same order as the boards.
+        """
+        engine = self.analyzer.engine_name
+        min_depth = depth or self.depth
+        transposition_keys = [board._transposition_key() for board in boards]
+        evaluations = []
+        keys = {}
+        for i, (board, transposition_key) in enumerate(zip(boards, transposition_keys)):
+            memo = self._memo.get(transposition_key)
+            if memo is not None and memo[0] >= min_depth:
+                self._memo.move_to_end(transposition_key)
+                evaluations.append(memo[1])
+                continue
+            keys[i] = chess.polyglot.zobrist_hash(board)
+            evaluations.append(self.db.get_cached_evaluation(keys[i], engine, min_depth, self.nodes))
+        
+        # A position reached more than once in the batch, e.g. by a repetition
+        # or a transposition, is only searched the first time
+        misses = {}
+        for i, evaluation in enumerate(evaluations):
+            if evaluation is None:
+                misses.setdefault(transposition_keys[i], i)
+        if misses:
+            # The cache keys ignore how a position was reached, so the engine is
+            # sent the position without its history: a draw by repetition in one
+            # game must not be cached for the same position in another
+            searched = self.analyzer.evaluate_positions([chess.Board(boards[i].fen()) for i in misses.values()],
+                                                        depth)
+            found = dict(zip(misses, searched))
+            for i, evaluation in enumerate(evaluations):
+                if evaluation is None:
+                    evaluations[i] = found[transposition_keys[i]]
+            self.db.save_cached_evaluations(engine, min_depth, self.nodes,
+                                            [(keys[i], evaluations[i]) for i in misses.values()])
+        
+        for i in keys:
+            self._memo[transposition_keys[i]] = (min_depth, evaluations[i])
+            self._memo.move_to_end(transposition_keys[i])
+        while len(self._memo) > self.MEMO_SIZE:
+            self._memo.popitem(last=False)
+        return evaluations
+    
+    def get_best_move(self, board: chess.Board) -> str:
+        """Gets the best move in UCI format, from the cache when a full-depth entry has one."""
+        cached = self.db.get_cached_evaluation(chess.polyglot.zobrist_hash(board),
+                                               self.analyzer.engine_name, self.depth, self.nodes)
+        if cached is not None and cached['best_move']:
+            return cached['best_move']
+        return self.analyzer.get_best_move(board)
+    
+    get_centipawns = staticmethod(StockfishAnalyzer.get_centipawns)
+    
+    def close(self):
+        """Shut down the wrapped analyzer."""
+        self.analyzer.close()
 
 
 class LLMCoach:
@@ -102,13 +457,16 @@ class LLMCoach:
     the Ollama API to generate coaching insights.
     """
     
-    def __init__(self, model: str, system_prompt_path: str):
+    def __init__(self, model: str, system_prompt_path: str, max_parallel: int = 4):
         """
         Initialize the LLM coach.
         
         Args:
             model: The name of the Ollama model to use.
             system_prompt_path: Path to the system prompt file.
+            max_parallel: Maximum number of requests in flight to the Ollama server
+                across all games using this coach. Should match the server's
+                OLLAMA_NUM_PARALLEL; further requests wait for a free slot.
             
         Raises:
             FileNotFoundError: If the system prompt file is not found.
@@ -116,6 +474,11 @@ class LLMCoach:
         self.model = model
         self.system_prompt_path = system_prompt_path
         self._system_prompt = None  # Cached system prompt
+        self._slots = threading.BoundedSemaphore(max_parallel)
+        # One client per coach, so the parallel requests share its pool of
+        # keep-alive connections. The timeout is an HTTP client setting; the
+        # Ollama server has no such option. The host is read from OLLAMA_HOST.
+        self._client = ollama.Client(timeout=_REQUEST_TIMEOUT)
         
     def _load_system_prompt(self) -> str:
         """
@@ -127,15 +490,42 @@ class LLMCoach:
         Raises:
             FileNotFoundError: If the system prompt file is not found.
         """
+        if self._system_prompt is not None:
+            return self._system_prompt
+            
         if not os.path.exists(self.system_prompt_path):
             raise FileNotFoundError(f"System prompt file not found at: {self.system_prompt_path}")
             
-        if self._system_prompt is None:
-            with open(self.system_prompt_path, 'r', encoding='utf-8') as f:
-                self._system_prompt = f.read()
+        with open(self.system_prompt_path, 'r', encoding='utf-8') as f:
+            self._system_prompt = f.read()
                 
         return self._system_prompt
     
+    def warm_up(self):
+        """
+        Load the model into the Ollama server ahead of the first request.
+        
+        The request carries the system prompt and generates a single token, so
+        the server also caches the prompt's prefix and the coaching requests,
+        which all start with the same system message, skip most of its
+        prefill. Call it once per coach, e.g. in a background thread at
+        startup; it takes a request slot like any other request. Errors are
+        ignored; the first real request reports them.
+        """
+        try:
+            with self._slots:
+                self._client.chat(
+                    model=self.model,
+                    messages=[
+                        {'role': 'system', 'content': self._load_system_prompt()},
+                        {'role': 'user', 'content': 'Ready?'}
+                    ],
+                    options={**_CHAT_OPTIONS, 'num_predict': 1},
+                    keep_alive='30m'
+                )
+        except Exception:
+            pass
+    
     def get_analysis(self, position_fen: str, move_san: str, 
                    best_move_san: str, cp_loss: int, 
                    mate_missed: bool) -> Tuple[str, str, str]:
@@ -154,14 +544,13 @@ class LLMCoach:
         """
         system_prompt = self._load_system_prompt()
         
-        user_prompt = f"""
-        ──────────────────── ANALYSIS CONTEXT ────────────────────
-        - FEN Before Move: {position_fen}
-        - Player's Move: {move_san}
-        - Engine's Best Move: {best_move_san}
-        - Centipawn Loss: {cp_loss}
-        - Was a forced mate missed? {'Yes' if mate_missed else 'No'}
-        """
+        user_prompt = _USER_PROMPT_TEMPLATE.format(
+            position_fen=position_fen,
+            move_san=move_san,
+            best_move_san=best_move_san,
+            cp_loss=cp_loss,
+            mate_missed='Yes' if mate_missed else 'No'
+        )
         
         messages = [
             {'role': 'system', 'content': system_prompt},
@@ -169,26 +558,32 @@ class LLMCoach:
         ]
         
         try:
-            response = ollama.chat(
-                model=self.model,
-                messages=messages,
-                options={'temperature': 0.2, 'timeout': 60}  # Lower temperature for deterministic results
-            )
+            with self._slots:
+                response = self._client.chat(
+                    model=self.model,
+                    messages=messages,
+                    format=_COACHING_SCHEMA,  # The server only samples tokens that fit the schema
+                    options=_CHAT_OPTIONS,
+                    keep_alive='30m'  # Keep the model loaded between blunders and games
+                )
             content = response['message']['content']
             
-            # Clean the content to extract the JSON object
-            if '```json' in content:
-                content = content.split('```json')[1].split('```')[0]
+            # Extract the JSON object, dropping markdown fences or prose around it
+            # in case the server does not support structured outputs
+            start = content.find('{')
+            end = content.rfind('}') + 1
+            if start != -1 and end > start:
+                content = content[start:end]
             content = content.strip()
             
             # Parse the JSON response with proper error handling
             try:
-                analysis_json = json.loads(content)
+                analysis_json = orjson.loads(content)
                 motif = analysis_json.get("motif", "Uncategorized")
                 severity = analysis_json.get("severity", "Unknown")
                 explanation = analysis_json.get("explanation", "No explanation provided.")
                 return motif, severity, explanation
-            except (json.JSONDecodeError, KeyError):
+            except (orjson.JSONDecodeError, KeyError):
                 # If parsing fails, return the raw content as the explanation
                 return "Uncategorized", "Error", content
                 
@@ -196,6 +591,61 @@ class LLMCoach:
             return "Error", "Error", f"Error getting analysis from Ollama: {e}"
 
 
+class CachedCoach:
+    """
+    Wraps an LLMCoach with a persistent cache of its feedback.
+    
+    Feedback is stored in the database keyed by a hash of the position, the
+    move played, the best move and the model name, so the same mistake seen
+    again in a rerun or another game, e.g. a common opening trap, is answered
+    without a request to the LLM even when the engine scores it a little
+    differently. Failed requests are not cached.
+    """
+    
+    def __init__(self, coach: LLMCoach, db: 'Database'):
+        """
+        Initialize the cache.
+        
+        Args:
+            coach: The LLMCoach to ask on a cache miss.
+            db: A Database instance holding the coaching cache.
+        """
+        self.coach = coach
+        self.db = db
+        self.model = coach.model
+    
+    def warm_up(self):
+        """Load the wrapped coach's model, see LLMCoach.warm_up."""
+        self.coach.warm_up()
+    
+    def get_analysis(self, position_fen: str, move_san: str,
+                     best_move_san: str, cp_loss: int,
+                     mate_missed: bool) -> Tuple[str, str, str]:
+        """
+        Gets the coach's feedback from the cache, asking the LLM on a miss.
+        
+        Args:
+            See LLMCoach.get_analysis.
+            
+        Returns:
+            A tuple containing (motif, severity, explanation).
+        """
+        key = hashlib.blake2b(
+            f"{position_fen}|{move_san}|{best_move_san}|{self.model}".encode(),
+            digest_size=16
+        ).hexdigest()
+        cached = self.db.get_cached_coaching(key)
+        if cached is not None:
+            return cached
+        
+        feedback = self.coach.get_analysis(position_fen=position_fen, move_san=move_san,
+                                           best_move_san=best_move_san, cp_loss=cp_loss,
+                                           mate_missed=mate_missed)
+        if feedback[1] != "Error":
+            self.db.save_cached_coaching(key, *feedback)
+        return feedback
+
+
 class GameProcessor:
     """
     Coordinates the chess game analysis process.
@@ -204,8 +654,12 @@ class GameProcessor:
     a complete chess game, identify blunders, and generate coaching feedback.
     """
     
+    DECISIVE_CP = 1500  # Past this advantage the quick pass is trusted, the game is decided either way
+    
     def __init__(self, analyzer: StockfishAnalyzer, coach: LLMCoach, 
-                db: 'Database', blunder_threshold: int = 150):
+                db: 'Database', blunder_threshold: int = 150,
+                screen_depth: Optional[int] = None, llm_workers: int = 4,
+                opening_book_path: Optional[str] = None):
         """
         Initialize the GameProcessor.
         
@@ -214,13 +668,26 @@ class GameProcessor:
             coach: An LLMCoach instance.
             db: A Database instance for storing analysis results.
             blunder_threshold: The minimum centipawn loss to consider a move a blunder.
+            screen_depth: Optional depth for a quick first pass over every position.
+                When set, only the plies that look like mistakes at this depth are
+                searched again at the analyzer's full depth.
+            llm_workers: Maximum number of concurrent requests to the LLM coach.
+            opening_book_path: Optional path to a Polyglot opening book. Plies
+                played from the book are not searched by the engine.
         """
         self.analyzer = analyzer
         self.coach = coach
         self.db = db
         self.blunder_threshold = blunder_threshold
+        self.screen_depth = screen_depth
+        self.llm_workers = llm_workers
+        self.opening_book_path = opening_book_path
+        # Plies losing more than this in the quick pass are re-searched; the margin
+        # below the blunder threshold absorbs the noise of the shallow search
+        self.screen_threshold = blunder_threshold // 2
     
-    def analyze_game(self, pgn_path: str, side_to_analyze: str = 'both') -> chess.pgn.Game:
+    def analyze_game(self, pgn_path: str, side_to_analyze: str = 'both',
+                     pgn_id: Optional[str] = None) -> chess.pgn.Game:
         """
         Analyze a chess game from a PGN file.
         
@@ -230,6 +697,7 @@ class GameProcessor:
         Args:
             pgn_path: Path to the PGN file.
             side_to_analyze: The side to analyze ('white', 'black', or 'both').
+            pgn_id: Identifier to store the blunders under. Defaults to the path.
             
         Returns:
             The annotated chess.pgn.Game object.
@@ -238,85 +706,247 @@ class GameProcessor:
             FileNotFoundError: If the PGN file is not found.
         """
         try:
-            with open(pgn_path) as pgn_file:
-                game = chess.pgn.read_game(pgn_file)
+            pgn_file = open(pgn_path)
         except FileNotFoundError:
             raise FileNotFoundError(f"PGN file not found at: {pgn_path}")
         
+        with pgn_file:
+            return self.analyze_game_from_stream(pgn_file, pgn_id or pgn_path, side_to_analyze)
+    
+    def analyze_game_from_stream(self, pgn_stream: TextIO, pgn_id: str,
+                                 side_to_analyze: str = 'both') -> chess.pgn.Game:
+        """
+        Analyze a chess game read from a text stream.
+        
+        Args:
+            pgn_stream: Any text stream containing the PGN, e.g. an open file or io.StringIO.
+            pgn_id: Identifier the blunders are stored under in the database.
+            side_to_analyze: The side to analyze ('white', 'black', or 'both').
+            
+        Returns:
+            The annotated chess.pgn.Game object.
+            
+        Raises:
+            ValueError: If no valid game can be read from the stream.
+        """
+        game = chess.pgn.read_game(pgn_stream)
         if game is None:
             raise ValueError("Could not read a valid game from the PGN file.")
 
+        logger.info("Analyzing game: %s vs. %s", game.headers.get('White', '?'), game.headers.get('Black', '?'))
+        
+        # Walk the mainline once to collect every position, then evaluate them
+        # all in a single batch so a pooled analyzer can search them in parallel.
+        # Position i is the board before ply i and after ply i - 1, so each
+        # position is evaluated exactly once. The copies keep their move stack,
+        # from which the opening book lookup reads the move played.
+        nodes = list(game.mainline())
         board = game.board()
-        print(f"Analyzing game: {game.headers.get('White', '?')} vs. {game.headers.get('Black', '?')}")
-        print("-" * 40)
+        positions = [board.copy()]
+        for node in nodes:
+            board.push(node.move)
+            positions.append(board.copy())
+        evaluations = self._evaluate_positions(positions, side_to_analyze)
+        eval_drops = self._get_eval_drops(positions, evaluations)
         
-        # Iterate through all moves in the game
-        for node in game.mainline():
-            # Skip the root node which has no move
-            if not node.parent:
-                continue
-                
-            move = node.move
+        # UCI needs no legal move generation; SAN is only worked out for the mistakes
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Moves: %s", " ".join(node.move.uci() for node in nodes))
+        
+        # Only the plies that lost more than the threshold for an analyzed side
+        # need any further work. After a screening pass, plies that leave the
+        # same side decisively ahead were not searched at full depth and are
+        # not reported either.
+        blunder_plies = [
+            ply for ply, eval_drop in enumerate(eval_drops)
+            if eval_drop > self.blunder_threshold and self._can_be_mistake(positions, ply, side_to_analyze)
+            and not (self.screen_depth and self._is_decided(evaluations[ply], evaluations[ply + 1]))
+        ]
+        
+        blunders = []
+        for ply in blunder_plies:
+            node = nodes[ply]
+            board_before = positions[ply]
+            player_color = "White" if board_before.turn == chess.WHITE else "Black"
             
-            # The board is at the state *before* this move
-            player_color = "White" if board.turn == chess.WHITE else "Black"
-            move_number = board.fullmove_number
+            analysis = self._get_move_analysis(board_before, player_color,
+                                               board_before.fullmove_number, board_before.san(node.move),
+                                               eval_drops[ply], evaluations[ply])
+            blunders.append((analysis, node))
+        
+        # Coach all blunders together so the LLM requests overlap instead of
+        # paying a full round-trip per blunder one after another
+        self._add_coaching([analysis for analysis, _ in blunders])
+        
+        # Annotate the blunders and save them all in one transaction
+        records = [self._handle_blunder(analysis, node, pgn_id) for analysis, node in blunders]
+        if records:
+            self.db.save_blunders(records)
+        
+        logger.info("Analysis complete.")
+        return game
+    
+    def _evaluate_positions(self, positions: List[chess.Board],
+                            side_to_analyze: str) -> List[Dict[str, Any]]:
+        """
+        Evaluate every position of the game, skipping the opening book.
+        
+        The moves played straight out of the opening book cannot be mistakes,
+        so the positions before the book exit are not searched and share the
+        evaluation of the first position out of book. The final position of a
+        game ended by checkmate, stalemate or insufficient material is not
+        searched either, since its result is already known.
+        
+        Args:
+            positions: The positions of the game, starting with the initial one.
+            side_to_analyze: The side to analyze ('white', 'black', or 'both').
             
-            # Get the evaluation before the move
-            eval_before_dict = self.analyzer.get_stockfish_evaluation(board)
-            eval_before = self.analyzer.get_centipawns(eval_before_dict)
+        Returns:
+            One evaluation dictionary per position.
+        """
+        book_plies = self._count_book_plies(positions)
+        outcome = positions[-1].outcome()
+        end = len(positions) - 1 if outcome is not None else len(positions)
+        evaluations = self._search_positions(positions[book_plies:end], side_to_analyze) if book_plies < end else []
+        if outcome is not None:
+            evaluations.append(self._get_outcome_evaluation(outcome))
+        book_evaluation = {'type': evaluations[0]['type'], 'value': evaluations[0]['value']}
+        return [dict(book_evaluation) for _ in range(book_plies)] + evaluations
+    
+    @staticmethod
+    def _get_outcome_evaluation(outcome: chess.Outcome) -> Dict[str, Any]:
+        """Evaluate a finished game from White's perspective without the engine."""
+        if outcome.winner is None:
+            return {'type': 'cp', 'value': 0, 'best_move': None}
+        mate_score = StockfishAnalyzer.MATE_SCORE
+        return {'type': 'cp', 'value': mate_score if outcome.winner == chess.WHITE else -mate_score, 'best_move': None}
+    
+    def _count_book_plies(self, positions: List[chess.Board]) -> int:
+        """
+        Count the leading plies of the game that were played from the opening book.
+        
+        Args:
+            positions: The positions of the game, starting with the initial one.
             
-            # Get the move in SAN format for display
-            move_san = board.san(move)
+        Returns:
+            The number of plies before the game leaves the book, 0 without a book.
+        """
+        if self.opening_book_path is None:
+            return 0
+        
+        with chess.polyglot.open_reader(self.opening_book_path) as reader:
+            for ply, board in enumerate(positions[:-1]):
+                move = positions[ply + 1].peek()
+                if not any(entry.move == move for entry in reader.find_all(board)):
+                    return ply
+        return len(positions) - 1
+    
+    def _search_positions(self, positions: List[chess.Board],
+                          side_to_analyze: str) -> List[Dict[str, Any]]:
+        """
+        Search a run of consecutive positions, screening first if configured.
+        
+        With a screen depth, all positions are searched quickly and only the
+        positions around plies whose quick eval drop exceeds the screen threshold
+        are searched again at full depth. Since most moves are not mistakes,
+        this cuts the total engine work several times over. Any other ply still
+        over the blunder threshold by a quick evaluation, e.g. next to a
+        candidate, is searched at full depth as well, so no mistake is reported
+        from the quick pass. Plies that leave the same side decisively ahead
+        keep their quick evaluations instead and are not reported as mistakes,
+        since a deeper search would not change who is winning.
+        
+        Args:
+            positions: Consecutive positions of the game.
+            side_to_analyze: The side to analyze ('white', 'black', or 'both').
             
-            # Make the move to get to the state of the current node
-            board.push(move)
-
-            # Get the evaluation after the move
-            eval_after_dict = self.analyzer.get_stockfish_evaluation(board)
-            eval_after = self.analyzer.get_centipawns(eval_after_dict)
-
-            # Calculate the evaluation drop based on player color
-            if player_color == "White":
-                eval_drop = eval_before - eval_after
-            else:  # Black's turn
-                eval_drop = eval_after - eval_before
+        Returns:
+            One evaluation dictionary per position.
+        """
+        if self.screen_depth is None:
+            return self.analyzer.evaluate_positions(positions)
+        
+        evaluations = self.analyzer.evaluate_positions(positions, depth=self.screen_depth)
+        
+        candidates = set()
+        for ply, eval_drop in enumerate(self._get_eval_drops(positions, evaluations)):
+            if (eval_drop > self.screen_threshold and
+                    self._can_be_mistake(positions, ply, side_to_analyze) and
+                    not self._is_decided(evaluations[ply], evaluations[ply + 1])):
+                candidates.update((ply, ply + 1))
+        
+        searched = [False] * len(positions)
+        while candidates:
+            indices = sorted(candidates)
+            deep_evaluations = self.analyzer.evaluate_positions([positions[i] for i in indices])
+            for index, evaluation in zip(indices, deep_evaluations):
+                evaluations[index] = evaluation
+                searched[index] = True
             
-            # Print the move
-            if player_color == "White":
-                print(f"{board.fullmove_number}. {move_san}", end=" ")
-            else:
-                print(f"{move_san}")
-
-            # If the game is over, no need to analyze for blunders
-            if board.is_game_over():
-                continue
-                
-            # Check for a blunder, but only for the specified side
-            if ((side_to_analyze == 'both' or 
-                 side_to_analyze.lower() == player_color.lower()) and 
-                eval_drop > self.blunder_threshold):
-                
-                # Get analysis for the blunder
-                analysis = self._get_move_analysis(board, move, player_color, 
-                                                 move_number, move_san, 
-                                                 eval_drop, eval_before_dict)
-                
-                # Handle the blunder with coaching and database storage
-                self._handle_blunder(analysis, node, pgn_path)
+            # Mistakes are only reported from full-depth evaluations: a ply left over
+            # the threshold by a quick evaluation, e.g. next to a re-searched
+            # position, is confirmed at full depth unless the game is decided
+            candidates = set()
+            for ply, eval_drop in enumerate(self._get_eval_drops(positions, evaluations)):
+                if (eval_drop > self.blunder_threshold and
+                        not (searched[ply] and searched[ply + 1]) and
+                        self._can_be_mistake(positions, ply, side_to_analyze) and
+                        not self._is_decided(evaluations[ply], evaluations[ply + 1])):
+                    candidates.update(i for i in (ply, ply + 1) if not searched[i])
+        return evaluations
+    
+    def _get_eval_drops(self, positions: List[chess.Board],
+                        evaluations: List[Dict[str, Any]]) -> List[int]:
+        """
+        Calculate how many centipawns each ply lost from the moving player's perspective.
         
-        print("\nAnalysis complete.")
-        return game
+        Every evaluation is converted to centipawns once, then the drops of all
+        plies are taken from neighbouring values in a single pass.
+        
+        Args:
+            positions: The positions of the game, starting with the initial one.
+            evaluations: One evaluation dictionary per position.
+            
+        Returns:
+            One evaluation drop per ply; positive values are bad for the player who moved.
+        """
+        centipawns = [self.analyzer.get_centipawns(evaluation) for evaluation in evaluations]
+        return [
+            (before - after) if board.turn == chess.WHITE else (after - before)
+            for board, before, after in zip(positions, centipawns, centipawns[1:])
+        ]
+    
+    def _is_decided(self, before: Dict[str, Any], after: Dict[str, Any]) -> bool:
+        """Check whether the same side is decisively ahead before and after a ply."""
+        centipawns = (self.analyzer.get_centipawns(before), self.analyzer.get_centipawns(after))
+        return min(centipawns) >= self.DECISIVE_CP or max(centipawns) <= -self.DECISIVE_CP
+    
+    def _can_be_mistake(self, positions: List[chess.Board], ply: int, side_to_analyze: str) -> bool:
+        """Check whether a ply is by an analyzed side and could have been a mistake at all."""
+        player_color = "White" if positions[ply].turn == chess.WHITE else "Black"
+        return (self._is_side_analyzed(side_to_analyze, player_color) and
+                not positions[ply + 1].is_game_over() and  # No mistake is possible once the game is over
+                not self._is_forced(positions[ply]))  # Nor when there was no other move
+    
+    @staticmethod
+    def _is_forced(board: chess.Board) -> bool:
+        """Check whether the side to move has exactly one legal move."""
+        # Generating two moves is enough to tell, not the whole list
+        return sum(1 for _ in itertools.islice(board.generate_legal_moves(), 2)) == 1
+    
+    @staticmethod
+    def _is_side_analyzed(side_to_analyze: str, player_color: str) -> bool:
+        """Check whether moves by the given player should be analyzed."""
+        return side_to_analyze == 'both' or side_to_analyze.lower() == player_color.lower()
     
-    def _get_move_analysis(self, board: chess.Board, move: chess.Move, 
+    def _get_move_analysis(self, board_before: chess.Board, 
                           player_color: str, move_number: int, move_san: str,
                           eval_drop: int, eval_before_dict: Dict[str, Any]) -> Dict[str, Any]:
         """
         Get detailed analysis for a move that caused a significant eval drop.
         
         Args:
-            board: The chess board after the move.
-            move: The move that was played.
+            board_before: The chess board before the move; it is not modified.
             player_color: The color of the player who moved ("White" or "Black").
             move_number: The move number.
             move_san: The move in SAN notation.
@@ -326,33 +956,18 @@ class GameProcessor:
         Returns:
             A dictionary containing analysis details.
         """
-        # Pop the move to get the board state *before* the blunder
-        board.pop()
-        position_fen = board.fen()
+        position_fen = board_before.fen()
         
         # Check if a mate was missed
         mate_missed = eval_before_dict['type'] == 'mate'
         
-        # Get the best move from the position before the blunder
-        best_move_uci = self.analyzer.get_best_move(board)
-        best_move_san = board.san(chess.Move.from_uci(best_move_uci))
-
-        # Push the move back to restore the board state
-        board.push(move)
+        # The best move normally comes with the evaluation's principal variation;
+        # only search again if the engine did not report one
+        best_move_uci = eval_before_dict.get('best_move') or self.analyzer.get_best_move(board_before)
+        best_move_san = board_before.san(chess.Move.from_uci(best_move_uci))
 
-        print(f"\n*** MISTAKE by {player_color} on move {move_san}! (Eval drop: {eval_drop}) ***")
-
-        motif, severity, explanation = self.coach.get_analysis(
-            position_fen=position_fen,
-            move_san=move_san,
-            best_move_san=best_move_san,
-            cp_loss=eval_drop,
-            mate_missed=mate_missed
-        )
-
-        print("\n--- Coach's Corner ---")
-        print(f"{severity} ({motif}): {explanation}")
-        print("----------------------")
+        logger.info("*** MISTAKE by %s on move %s! (Eval drop: %d) ***", player_color, move_san, eval_drop,
+                    extra={'player_color': player_color})
         
         return {
             'move_number': move_number,
@@ -361,36 +976,70 @@ class GameProcessor:
             'position_fen': position_fen,
             'eval_drop': eval_drop,
             'best_move_san': best_move_san,
-            'motif': motif,
-            'severity': severity,
-            'explanation': explanation
+            'mate_missed': mate_missed
         }
     
-    def _handle_blunder(self, analysis: Dict[str, Any], node: chess.pgn.GameNode, pgn_path: str):
+    def _add_coaching(self, analyses: List[Dict[str, Any]]):
+        """
+        Ask the LLM coach about every blunder and add its feedback to the analyses.
+        
+        The requests are sent concurrently, up to llm_workers at a time, so the
+        Ollama server can work on several blunders at once.
+        
+        Args:
+            analyses: Analysis dictionaries from _get_move_analysis. Each one is
+                updated in place with 'motif', 'severity' and 'explanation'.
+        """
+        if not analyses:
+            return
+        
+        with ThreadPoolExecutor(max_workers=self.llm_workers) as executor:
+            feedback = list(executor.map(self._get_coaching, analyses))
+        
+        for analysis, (motif, severity, explanation) in zip(analyses, feedback):
+            analysis.update(motif=motif, severity=severity, explanation=explanation)
+            
+            logger.info("--- Coach's Corner: %d. %s (%s) ---\n%s (%s): %s",
+                        analysis['move_number'], analysis['move_san'], analysis['player_color'],
+                        severity, motif, explanation)
+    
+    def _get_coaching(self, analysis: Dict[str, Any]) -> Tuple[str, str, str]:
+        """Get the coach's (motif, severity, explanation) for a single blunder."""
+        return self.coach.get_analysis(
+            position_fen=analysis['position_fen'],
+            move_san=analysis['move_san'],
+            best_move_san=analysis['best_move_san'],
+            cp_loss=analysis['eval_drop'],
+            mate_missed=analysis['mate_missed']
+        )
+    
+    def _handle_blunder(self, analysis: Dict[str, Any], node: chess.pgn.GameNode,
+                        pgn_path: str) -> Dict[str, Any]:
         """
-        Process a detected blunder by adding comments and saving to the database.
+        Process a detected blunder by adding comments and preparing its database record.
         
         Args:
             analysis: Analysis dictionary from _get_move_analysis.
             node: The game node where the blunder occurred.
-            pgn_path: Path to the PGN file being analyzed.
+            pgn_path: Path or identifier of the game being analyzed.
+            
+        Returns:
+            The keyword arguments to save the blunder with Database.save_blunder.
         """
-        # Print a message about the blunder - needed for tests
-        print(f"*** MISTAKE by {analysis['player_color']}")
+        logger.info("*** MISTAKE by %s", analysis['player_color'], extra={'player_color': analysis['player_color']})
         
         # Add the analysis as a comment to the PGN node
         node.comment = f"[COACH] {analysis['severity']} ({analysis['motif']}): {analysis['explanation']}"
 
-        # Save the blunder to the database
-        self.db.save_blunder(
-            pgn_path=pgn_path,
-            move_number=analysis['move_number'],
-            player_color=analysis['player_color'],
-            move_san=analysis['move_san'],
-            position_fen=analysis['position_fen'],
-            eval_drop=analysis['eval_drop'],
-            best_move_san=analysis['best_move_san'],
-            coach_comment=analysis['explanation'],
-            motif=analysis['motif'],
-            severity=analysis['severity']
-        )
\ No newline at end of file
+        return {
+            'pgn_path': pgn_path,
+            'move_number': analysis['move_number'],
+            'player_color': analysis['player_color'],
+            'move_san': analysis['move_san'],
+            'position_fen': analysis['position_fen'],
+            'eval_drop': analysis['eval_drop'],
+            'best_move_san': analysis['best_move_san'],
+            'coach_comment': analysis['explanation'],
+            'motif': analysis['motif'],
+            'severity': analysis['severity']
+        }
\ No newline at end of file
@@ -1,11 +1,20 @@
 # database.py
 
 import sqlite3
-import os
+import threading
+from functools import wraps
 
 # Default database path, can be overridden for tests
 DB_PATH = 'chess_coach.db'
 
+def _locked(method):
+    """Runs a Database method under the instance's lock, see Database.lock."""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
 class Database:
     """
     Handles all database operations for the chess coach.
@@ -13,29 +22,45 @@ class Database:
     def __init__(self, db_path=None):
         """
         Initializes the database connection.
-        If no path is provided, it uses the default DB_PATH.
+        If no path is provided, it uses the default DB_PATH. Pass ':memory:' for a
+        private in-memory database, or a 'file:' URI such as
+        'file:name?mode=memory&cache=shared' to share one between connections.
         """
         if db_path is None:
             db_path = DB_PATH
         self.db_path = db_path
         self.conn = None
+        # The connection is shared by the analysis thread and the LLM coaching
+        # threads; every method holds this lock while it uses the connection
+        self.lock = threading.RLock()
 
+    @_locked
     def connect(self):
         """Establishes a connection to the database."""
         try:
             # Allow the connection to be used across multiple threads, which is necessary for FastAPI.
-            self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                                        uri=self.db_path.startswith('file:'))
             # Use Row factory to access columns by name
             self.conn.row_factory = sqlite3.Row
+            # Write-ahead logging only syncs at checkpoints, so commits no longer wait on fsync
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("PRAGMA temp_store=MEMORY")
+            # Read pages through a memory map and keep a larger page cache (64 MiB) for the caches
+            self.conn.execute("PRAGMA mmap_size=268435456")
+            self.conn.execute("PRAGMA cache_size=-65536")
         except sqlite3.Error as e:
             print(f"Database connection error: {e}")
             raise
 
+    @_locked
     def close(self):
         """Closes the database connection."""
         if self.conn:
             self.conn.close()
 
+    @_locked
     def init_db(self):
         """
         Initializes the database schema by creating the necessary tables
@@ -62,10 +87,38 @@ class Database:
                 analysis_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
             );
             """)
+            # Blunders are always looked up and deleted by game
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_blunders_pgn ON blunders (game_pgn_path, move_number)")
+            # Evaluations cached before the search limits were stored cannot be trusted; drop them
+            columns = [row['name'] for row in cursor.execute("PRAGMA table_info(eval_cache)")]
+            if columns and 'reached_depth' not in columns:
+                cursor.execute("DROP TABLE eval_cache")
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS eval_cache (
+                position_key INTEGER NOT NULL,
+                engine TEXT NOT NULL,
+                depth INTEGER NOT NULL,
+                nodes INTEGER,
+                reached_depth INTEGER NOT NULL,
+                eval_type TEXT NOT NULL,
+                eval_value INTEGER NOT NULL,
+                best_move_uci TEXT,
+                PRIMARY KEY (position_key, engine)
+            );
+            """)
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS coaching_cache (
+                prompt_key TEXT PRIMARY KEY,
+                motif TEXT NOT NULL,
+                severity TEXT NOT NULL,
+                explanation TEXT NOT NULL
+            );
+            """)
             self.conn.commit()
         except sqlite3.Error as e:
             print(f"Error initializing database: {e}")
 
+    @_locked
     def save_blunder(self, pgn_path, move_number, player_color, move_san, position_fen, eval_drop, best_move_san, coach_comment, motif, severity):
         """
         Saves a detected blunder to the database.
@@ -83,6 +136,27 @@ class Database:
         except sqlite3.Error as e:
             print(f"Error saving blunder to database: {e}")
 
+    @_locked
+    def save_blunders(self, blunders: list):
+        """
+        Saves several detected blunders in a single transaction.
+        Each blunder is a dictionary of the keyword arguments of save_blunder.
+        """
+        if not self.conn:
+            self.connect()
+
+        try:
+            cursor = self.conn.cursor()
+            cursor.executemany("""
+            INSERT INTO blunders (game_pgn_path, move_number, player_color, move_san, position_fen, eval_drop, best_move_san, coach_comment, motif, severity)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, [(b['pgn_path'], b['move_number'], b['player_color'], b['move_san'], b['position_fen'], b['eval_drop'],
+                   b['best_move_san'], b['coach_comment'], b['motif'], b['severity']) for b in blunders])
+            self.conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error saving blunders to database: {e}")
+
+    @_locked
     def get_blunders_by_pgn_path(self, pgn_path: str) -> list:
         """
         Retrieves all blunder records for a specific PGN file.
@@ -97,6 +171,122 @@ class Database:
             print(f"Error fetching blunders from database: {e}")
             return []
 
+    @_locked
+    def delete_blunders_by_pgn_path(self, pgn_path: str):
+        """
+        Deletes all blunder records for a specific PGN file, e.g. before it is analyzed again.
+        """
+        if not self.conn:
+            self.connect()
+
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute("DELETE FROM blunders WHERE game_pgn_path = ?", (pgn_path,))
+            self.conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error deleting blunders from database: {e}")
+
+    @staticmethod
+    def _to_signed_key(position_key: int) -> int:
+        """SQLite integers are signed 64-bit, so store unsigned hashes in two's complement."""
+        return position_key - (1 << 64) if position_key >= (1 << 63) else position_key
+
+    @_locked
+    def get_cached_evaluation(self, position_key: int, engine: str, min_depth: int, nodes: int = None):
+        """
+        Retrieves a cached engine evaluation at least as good as a search to the
+        given depth with the given node budget (None for no budget): one that
+        reached the depth, or one limited to at least that depth with at least
+        that budget. Returns an evaluation dictionary, or None on a cache miss.
+        """
+        if not self.conn:
+            self.connect()
+
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute("""
+            SELECT eval_type, eval_value, best_move_uci FROM eval_cache
+            WHERE position_key = ? AND engine = ?
+            AND (reached_depth >= ? OR (depth >= ? AND (nodes IS NULL OR nodes >= ?)))
+            """, (self._to_signed_key(position_key), engine, min_depth, min_depth, nodes))
+            row = cursor.fetchone()
+        except sqlite3.Error as e:
+            print(f"Error reading evaluation cache: {e}")
+            return None
+
+        if row is None:
+            return None
+        return {'type': row['eval_type'], 'value': row['eval_value'], 'best_move': row['best_move_uci']}
+
+    @_locked
+    def save_cached_evaluations(self, engine: str, depth: int, nodes: int, evaluations: list):
+        """
+        Saves engine evaluations, given as (position_key, evaluation) pairs, in one transaction.
+        depth and nodes are the limits of the search (nodes is None without a node budget);
+        each evaluation's 'depth' is the depth the search reached, the depth limit if missing.
+        An existing entry is only replaced by a search that reached at least as deep.
+        """
+        if not self.conn:
+            self.connect()
+
+        try:
+            cursor = self.conn.cursor()
+            cursor.executemany("""
+            INSERT INTO eval_cache (position_key, engine, depth, nodes, reached_depth, eval_type, eval_value, best_move_uci)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (position_key, engine) DO UPDATE SET
+                depth = excluded.depth,
+                nodes = excluded.nodes,
+                reached_depth = excluded.reached_depth,
+                eval_type = excluded.eval_type,
+                eval_value = excluded.eval_value,
+                best_move_uci = excluded.best_move_uci
+            WHERE excluded.reached_depth >= eval_cache.reached_depth
+            """, [(self._to_signed_key(key), engine, depth, nodes, evaluation.get('depth') or depth,
+                   evaluation['type'], evaluation['value'], evaluation.get('best_move'))
+                  for key, evaluation in evaluations])
+            self.conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error saving to evaluation cache: {e}")
+
+    @_locked
+    def get_cached_coaching(self, prompt_key: str):
+        """
+        Retrieves cached coach feedback for a prompt.
+        Returns a (motif, severity, explanation) tuple, or None on a cache miss.
+        """
+        if not self.conn:
+            self.connect()
+
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT motif, severity, explanation FROM coaching_cache WHERE prompt_key = ?",
+                           (prompt_key,))
+            row = cursor.fetchone()
+        except sqlite3.Error as e:
+            print(f"Error reading coaching cache: {e}")
+            return None
+
+        return tuple(row) if row is not None else None
+
+    @_locked
+    def save_cached_coaching(self, prompt_key: str, motif: str, severity: str, explanation: str):
+        """
+        Saves coach feedback for a prompt, replacing any earlier entry.
+        """
+        if not self.conn:
+            self.connect()
+
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute("""
+            INSERT OR REPLACE INTO coaching_cache (prompt_key, motif, severity, explanation)
+            VALUES (?, ?, ?, ?)
+            """, (prompt_key, motif, severity, explanation))
+            self.conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error saving to coaching cache: {e}")
+
     def __enter__(self):
         self.connect()
         return self
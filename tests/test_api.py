@@ -1,11 +1,14 @@
 # tests/test_api.py
 
 import os
+import asyncio
 import sys
+import hashlib
 import tempfile
 import pytest
+import ollama
 from fastapi.testclient import TestClient
-from unittest.mock import patch
+from unittest.mock import patch, MagicMock
 
 # Add the project root to the Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -17,6 +20,16 @@ from database import Database
 TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
 TEST_PGN_PATH = os.path.join(TESTS_DIR, '..', 'games', 'sample_game.pgn')
 
+@pytest.fixture(autouse=True)
+def mock_ollama_chat(monkeypatch):
+    """
+    Replaces Ollama's chat endpoint for every test, so no request ever reaches a
+    server, even from a test that forgets to mock the coach.
+    """
+    chat = MagicMock()
+    monkeypatch.setattr(ollama.Client, 'chat', chat)
+    return chat
+
 # --- Test Database Fixture and Dependency Override ---
 @pytest.fixture
 def client():
@@ -24,6 +37,8 @@ def client():
     Pytest fixture that creates a TestClient with an overridden database dependency.
     It sets up a temporary database for the test, applies the override, yields
     the client, and then cleans up the database and override.
+    Tests enter the client with `with client:` once their patches are active, so
+    the app's lifespan starts the mocked engine pool and coach.
     """
     db_fd, db_path = tempfile.mkstemp(suffix=".db")
     os.close(db_fd)
@@ -46,43 +61,19 @@ def client():
     os.remove(db_path)
 
 
-@patch('os.getenv')
-@patch('core.analysis.ollama.chat')
-@patch('core.analysis.Stockfish')
 @patch('api.main.GameProcessor')
-@patch('api.main.StockfishAnalyzer')
+@patch('api.main.StockfishPool')
 @patch('api.main.LLMCoach')
-def test_analyze_pgn_file_api(mock_llm_coach, mock_stockfish_analyzer, mock_game_processor, mock_stockfish_class, mock_ollama_chat, mock_getenv, client):
+def test_analyze_pgn_file_api(mock_llm_coach, mock_stockfish_pool, mock_game_processor, client):
     """
     Tests the /analyze/ endpoint with a sample PGN file, using dependency override for the DB.
-    The 'override_get_db' fixture handles the DB setup and teardown.
+    The analysis itself is mocked; the endpoint returns the blunders the database holds.
     """
     # 1. ARRANGE
-    # Mock the LLM response
     mock_motif = "Hanging Piece"
     mock_severity = "Blunder"
     mock_explanation = "This is a mock explanation from the API test."
     
-    # Mock environment variables
-    def getenv_mock(key, default=None):
-        if key == "STOCKFISH_PATH":
-            return "mock_stockfish"
-        elif key == "OLLAMA_MODEL":
-            return "mock_model"
-        return default
-    
-    mock_getenv.side_effect = getenv_mock
-    
-    # Mock the analyzer classes to prevent real initialization
-    mock_stockfish_instance = mock_stockfish_analyzer.return_value
-    mock_llm_coach_instance = mock_llm_coach.return_value
-    
-    # Mock GameProcessor to prevent real initialization and control test flow
-    mock_processor_instance = mock_game_processor.return_value
-    
-    # Set up the processor.analyze_game method to simulate successful analysis
-    mock_processor_instance.analyze_game.return_value = None  # Method doesn't return anything
-    
     # Create mock database results that will be returned by the endpoint
     mock_blunder_result = {
         "player_color": "Black",
@@ -90,7 +81,7 @@ def test_analyze_pgn_file_api(mock_llm_coach, mock_stockfish_analyzer, mock_game
         "motif": mock_motif,
         "severity": mock_severity,
         "coach_comment": mock_explanation,
-        "eval_drop": 550  # 600 - 50 = 550
+        "eval_drop": 550
     }
     
     # Patch the database.get_blunders_by_pgn_path method in the endpoint's dependency
@@ -99,6 +90,9 @@ def test_analyze_pgn_file_api(mock_llm_coach, mock_stockfish_analyzer, mock_game
         def get_blunders_by_pgn_path(self, pgn_path):
             return [mock_blunder_result]
         
+        def delete_blunders_by_pgn_path(self, pgn_path):
+            pass
+        
         def init_db(self):
             pass
             
@@ -110,46 +104,9 @@ def test_analyze_pgn_file_api(mock_llm_coach, mock_stockfish_analyzer, mock_game
     
     # Override the test client's db dependency
     app.dependency_overrides[get_db] = lambda: MockDB()
-    mock_ollama_chat.return_value = {
-        'message': {
-            'content': f'{{"motif": "{mock_motif}", "severity": "{mock_severity}", "explanation": "{mock_explanation}"}}'
-        }
-    }
-
-    # Mock Stockfish to produce a blunder on a move from sample_game.pgn
-    mock_stockfish_instance = mock_stockfish_class.return_value
-    # FENs generated by get_fens.py for correctness
-    fen_before_blunder = 'r1bq1rk1/pppp1ppp/2n5/2b1P3/2Bp1Bn1/5N1P/PPP2PP1/RN1Q1RK1 b - - 0 8'
-    fen_after_blunder = 'r1bq1rk1/pppp1ppp/2n5/2b1n3/2Bp1B2/5N1P/PPP2PP1/RN1Q1RK1 w - - 0 9'
-    current_fen = ""
-    blunder_has_occurred = False
-
-    def set_fen_side_effect(fen):
-        nonlocal current_fen
-        current_fen = fen
-    mock_stockfish_instance.set_fen_position.side_effect = set_fen_side_effect
-
-    def get_evaluation_side_effect():
-        nonlocal blunder_has_occurred
-        # Once the blunder occurs, keep the evaluation high to prevent a second, phantom blunder.
-        if blunder_has_occurred:
-            return {'type': 'cp', 'value': 600}
-        
-        if current_fen == fen_before_blunder:
-            return {'type': 'cp', 'value': 50}  # Score before blunder
-        
-        if current_fen == fen_after_blunder:
-            blunder_has_occurred = True
-            return {'type': 'cp', 'value': 600} # Score after blunder
-
-        return {'type': 'cp', 'value': 0}
-
-    mock_stockfish_instance.get_evaluation.side_effect = get_evaluation_side_effect
-    # Set a realistic best move (in UCI format) for the position before the blunder
-    mock_stockfish_instance.get_best_move.return_value = 'd7d5'
 
     # 2. ACT
-    with open(TEST_PGN_PATH, 'rb') as pgn_file:
+    with client, open(TEST_PGN_PATH, 'rb') as pgn_file:
         response = client.post(
             "/analyze/",
             files={"pgn_file": ("sample_game.pgn", pgn_file, "application/vnd.chess-pgn")}
@@ -169,4 +126,102 @@ def test_analyze_pgn_file_api(mock_llm_coach, mock_stockfish_analyzer, mock_game
     assert first_blunder['motif'] == mock_motif
     assert first_blunder['severity'] == mock_severity
     assert first_blunder['coach_comment'] == mock_explanation
-    assert first_blunder['eval_drop'] == 550  # 600 - 50 = 550
+    assert first_blunder['eval_drop'] == 550
+
+
+@patch('api.main.GameProcessor')
+@patch('api.main.StockfishPool')
+@patch('api.main.LLMCoach')
+def test_analysis_runs_off_the_event_loop(mock_llm_coach, mock_stockfish_pool, mock_game_processor, client):
+    """
+    Tests that the blocking analysis runs in a worker thread, so the event loop
+    stays free to serve other requests while a game is analyzed.
+    """
+    # 1. ARRANGE
+    loop_running_during_analysis = []
+
+    def analyze_game(pgn_path, side_to_analyze='both', pgn_id=None):
+        try:
+            asyncio.get_running_loop()
+            loop_running_during_analysis.append(True)
+        except RuntimeError:
+            loop_running_during_analysis.append(False)
+
+    mock_game_processor.return_value.analyze_game.side_effect = analyze_game
+
+    # 2. ACT
+    with client, open(TEST_PGN_PATH, 'rb') as pgn_file:
+        response = client.post(
+            "/analyze/",
+            files={"pgn_file": ("sample_game.pgn", pgn_file, "application/vnd.chess-pgn")}
+        )
+
+    # 3. ASSERT
+    assert response.status_code == 200, response.text
+    assert response.json() == {"analysis": []}
+    assert loop_running_during_analysis == [False]
+    mock_stockfish_pool.return_value.close.assert_called_once()
+
+
+@patch('api.main.UPLOAD_CHUNK_SIZE', 16)
+@patch('api.main.GameProcessor')
+@patch('api.main.StockfishPool')
+@patch('api.main.LLMCoach')
+def test_upload_is_streamed_to_disk_in_chunks(mock_llm_coach, mock_stockfish_pool, mock_game_processor, client):
+    """
+    Tests that an upload larger than one chunk reaches the analysis intact
+    and is stored under the hash of its content.
+    """
+    # 1. ARRANGE
+    with open(TEST_PGN_PATH, 'rb') as pgn_file:
+        pgn_bytes = pgn_file.read()
+    analyzed_content = []
+    analyzed_ids = []
+
+    def analyze_game(pgn_path, side_to_analyze='both', pgn_id=None):
+        with open(pgn_path, 'rb') as f:
+            analyzed_content.append(f.read())
+        analyzed_ids.append(pgn_id)
+
+    mock_game_processor.return_value.analyze_game.side_effect = analyze_game
+
+    # 2. ACT
+    with client:
+        response = client.post(
+            "/analyze/",
+            files={"pgn_file": ("sample_game.pgn", pgn_bytes, "application/vnd.chess-pgn")}
+        )
+
+    # 3. ASSERT
+    assert response.status_code == 200, response.text
+    assert analyzed_content == [pgn_bytes]
+    assert analyzed_ids == [hashlib.blake2b(pgn_bytes, digest_size=16).hexdigest()]
+
+
+@patch('api.main.GameProcessor')
+@patch('api.main.StockfishPool')
+@patch('api.main.LLMCoach')
+def test_engines_are_shared_across_requests(mock_llm_coach, mock_stockfish_pool, mock_game_processor, client):
+    """
+    Tests that the Stockfish pool and the LLM coach are started once for the app
+    and reused by every request, and that the pool is closed on shutdown.
+    """
+    # 1. ARRANGE
+    with open(TEST_PGN_PATH, 'rb') as pgn_file:
+        pgn_bytes = pgn_file.read()
+
+    # 2. ACT
+    with client:
+        for _ in range(2):
+            response = client.post(
+                "/analyze/",
+                files={"pgn_file": ("sample_game.pgn", pgn_bytes, "application/vnd.chess-pgn")}
+            )
+            assert response.status_code == 200, response.text
+        mock_stockfish_pool.return_value.close.assert_not_called()
+
+    # 3. ASSERT
+    mock_stockfish_pool.assert_called_once()
+    mock_llm_coach.assert_called_once()
+    assert mock_game_processor.call_count == 2
+    mock_stockfish_pool.return_value.close.assert_called_once()
@@ -1,32 +1,128 @@
 # tests/test_coach.py
 
-import unittest
+import logging
+import io
+import json
+import struct
+import threading
 import os
 import chess
 import chess.pgn
-import tempfile
-import sqlite3
+import chess.engine
+import chess.polyglot
 import pytest
-from datetime import datetime
-from unittest.mock import patch, MagicMock, call, mock_open
+import ollama
+from unittest.mock import patch, MagicMock, create_autospec
 from database import Database
-from core.analysis import StockfishAnalyzer, LLMCoach, GameProcessor
+from core.analysis import StockfishAnalyzer, StockfishPool, CachedAnalyzer, LLMCoach, CachedCoach, GameProcessor
 import sys
 
 # Get the absolute path to the test PGN file
 TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
 TEST_PGN_PATH = os.path.join(TESTS_DIR, 'scholars_mate.pgn')
+SYSTEM_PROMPT_PATH = os.path.join(TESTS_DIR, '..', 'prompts', 'system_prompt.txt')
+# An existing file to pass the analyzer's path check; the engine process itself is mocked
+ENGINE_PATH = sys.executable
 
-# We patch the file system checks to make the test independent of the actual Stockfish executable's presence.
-def test_minimal_blunder_handling(capsys):
+# FENs around Black's blunder 3...Nf6?? in scholars_mate.pgn
+FEN_BEFORE_BLUNDER = 'r1bqkbnr/pppp1ppp/2n5/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR b KQkq - 3 3'  # After 3. Bc4
+FEN_AFTER_BLUNDER = 'r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4'  # After 3... Nf6
+# White's edge in centipawns by FEN; every other position of the game is level
+SCHOLARS_MATE_EVALUATIONS = {FEN_BEFORE_BLUNDER: 50, FEN_AFTER_BLUNDER: 800}
+
+# Coach feedback as (motif, severity, explanation), and canned Ollama replies carrying it
+FENCED_FEEDBACK = ("Missed Tactic", "Inaccuracy", "This is a test explanation inside a markdown block.")
+FORK_FEEDBACK = ("Fork", "Blunder", "The knight forks king and queen.")
+_FORK_JSON = json.dumps(dict(zip(('motif', 'severity', 'explanation'), FORK_FEEDBACK)))
+_FENCED_RESPONSE = {'message': {'content': '```json\n' + json.dumps(
+    dict(zip(('motif', 'severity', 'explanation'), FENCED_FEEDBACK)), indent=2) + '\n```'}}
+_PROSE_RESPONSE = {'message': {'content': 'Here is my analysis: ' + _FORK_JSON + ' Hope this helps!'}}
+_FORK_RESPONSE = {'message': {'content': _FORK_JSON}}
+
+@pytest.fixture(autouse=True)
+def mock_ollama_chat(monkeypatch):
     """
-    Tests that the _handle_blunder method correctly prints mistake messages.
-    This is a focused test for just the blunder handling printing functionality.
+    Replaces Ollama's chat endpoint for every test, so no test ever reaches a
+    server. Tests that script or inspect the LLM requests take this mock.
+    """
+    chat = MagicMock()
+    monkeypatch.setattr(ollama.Client, 'chat', chat)
+    return chat
+
+@pytest.fixture(scope='session')
+def db_template():
+    """An in-memory database with the schema created once for the whole test session."""
+    template = Database(':memory:')
+    template.init_db()
+    yield template
+    template.close()
+
+@pytest.fixture
+def db(db_template):
+    """A fresh in-memory database, cloned from db_template instead of running init_db() again."""
+    database = Database(':memory:')
+    database.connect()
+    db_template.conn.backup(database.conn)
+    yield database
+    database.close()
+
+@pytest.fixture(scope='session')
+def scholars_mate_pgn():
+    """The text of scholars_mate.pgn, read from disk once for the whole test session."""
+    with open(TEST_PGN_PATH, encoding='utf-8') as pgn_file:
+        return pgn_file.read()
+
+class FakeAnalyzer:
+    """
+    A stand-in for StockfishAnalyzer that looks evaluations up by FEN, treating
+    every other position as level, and always suggests the same best move.
+    The boards of every evaluate_positions call are logged in `searches`.
+    """
+    get_centipawns = staticmethod(StockfishAnalyzer.get_centipawns)
+
+    def __init__(self, evaluations, best_move):
+        self.evaluations = evaluations
+        self.best_move = best_move
+        self.searches = []
+
+    def evaluate_positions(self, boards, depth=None):
+        self.searches.append(boards)
+        return [{'type': 'cp', 'value': self.evaluations.get(board.fen(), 0)} for board in boards]
+
+    def get_best_move(self, board):
+        return self.best_move
+
+class FakeCoach:
+    """A stand-in for LLMCoach that gives the same feedback for every mistake."""
+    def __init__(self, feedback):
+        self.feedback = feedback
+
+    def get_analysis(self, **context):
+        return self.feedback
+
+class FakeDatabase:
+    """A stand-in for Database that discards the blunders it is given."""
+    def save_blunders(self, blunders):
+        pass
+
+@pytest.fixture
+def scholars_mate_analyzer():
+    """
+    An analyzer for scholars_mate.pgn under which only Black's 3...Nf6??
+    is a mistake: White's edge grows from 50 to 800 centipawns, and every
+    other position is level. The engine's best move is always g6.
+    """
+    return FakeAnalyzer(SCHOLARS_MATE_EVALUATIONS, 'g7g6')
+
+def test_minimal_blunder_handling(caplog):
+    """
+    Tests that the _handle_blunder method correctly logs mistake messages.
+    This is a focused test for just the blunder handling logging functionality.
     """
     # 1. ARRANGE
     # Create minimal mocks for GameProcessor
     db = MagicMock()
-    analyzer = MagicMock()
+    analyzer = create_autospec(StockfishAnalyzer, instance=True)
     coach = MagicMock()
     
     # Create a GameProcessor with mocked components
@@ -49,85 +145,35 @@ def test_minimal_blunder_handling(capsys):
     }
     
     # 2. ACT - Call _handle_blunder directly
+    caplog.set_level(logging.INFO, logger='core.analysis')
     processor._handle_blunder(mock_analysis, node, TEST_PGN_PATH)
     
-    # 3. ASSERT - Check if the output contains the expected mistake message
-    captured = capsys.readouterr()
-    output = captured.out
+    # 3. ASSERT - Check if the log contains the expected mistake message
+    output = caplog.text
     
     assert "*** MISTAKE by Black" in output
 
-@patch('core.analysis.ollama.chat')
-@patch('core.analysis.Stockfish')
-def test_blunder_triggers_analysis(mock_stockfish_class, mock_ollama_chat, capsys):
+def test_blunder_triggers_analysis(scholars_mate_analyzer, scholars_mate_pgn):
     """
     Tests that a clear blunder (significant eval drop) triggers analysis
     """
     # 1. ARRANGE
-    # Create a custom StockfishAnalyzer class for testing that returns predetermined evaluations
-    class TestStockfishAnalyzer:
-        def __init__(self):
-            # Define the key FEN positions for the Black blunder
-            self.fen_before_blunder = "r1bqkbnr/pppp1ppp/2n5/4p2Q/2B1P3"  # Position after 3.Bc4
-            self.fen_after_blunder = "r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3"  # Position after 3...Nf6
-            self.current_fen = ""
-            self.nf6_move_detected = False
-            
-        def set_fen_position(self, fen):
-            self.current_fen = fen
-            sys.stderr.write(f"Setting FEN: {fen[:50]}...\n")
-        
-        def get_stockfish_evaluation(self, board):
-            self.current_fen = board.fen()
-            
-            # Check if this is a position after Black's Nf6 move
-            if self.fen_after_blunder in self.current_fen:
-                sys.stderr.write(f"Detected position AFTER Black's Nf6 blunder\n")
-                self.nf6_move_detected = True
-                return {'type': 'cp', 'value': 800}  # Large advantage to White after blunder
-            # Check if this is the position before Black's Nf6 (after White's Bc4)
-            elif self.fen_before_blunder in self.current_fen:
-                sys.stderr.write(f"Detected position BEFORE Black's Nf6 blunder\n")
-                return {'type': 'cp', 'value': 50}  # Small advantage to White before blunder
-            # Any other position gets neutral evaluation
-            else:
-                sys.stderr.write(f"Other position detected: {self.current_fen[:30]}...\n")
-                return {'type': 'cp', 'value': 0}
-        
-        def get_best_move(self, board):
-            return 'g7g6'  # UCI format for g6 (better move than Nf6)
-        
-        def get_centipawns(self, evaluation):
-            if evaluation['type'] == 'cp':
-                return evaluation['value']
-            return 0
-            
-        def close(self):
-            pass
-    
-    # Mock LLM coach
-    mock_coach = MagicMock()
-    mock_coach.get_analysis.return_value = ("Test Motif", "Test Severity", "Mock analysis")
-    
-    # Mock database
-    mock_db = MagicMock()
-    
-    # Create our custom test analyzer
-    test_analyzer = TestStockfishAnalyzer()
+    # Stub LLM coach and database
+    mock_coach = FakeCoach(("Test Motif", "Test Severity", "Mock analysis"))
+    mock_db = FakeDatabase()
     
-    # 2. ACT - Create processor with our custom analyzer and analyze the game
+    # 2. ACT - Create processor with the scholar's mate analyzer and analyze the game
     # Spy on _handle_blunder method to verify it was called correctly
-    with patch.object(GameProcessor, '_handle_blunder') as handle_blunder_mock, \
-         patch('core.analysis.LLMCoach._load_system_prompt'):
-        
-        processor = GameProcessor(test_analyzer, mock_coach, mock_db, 150)
-        processor.analyze_game(TEST_PGN_PATH)
+    with patch.object(GameProcessor, '_handle_blunder') as handle_blunder_mock:
+        processor = GameProcessor(scholars_mate_analyzer, mock_coach, mock_db, 150)
+        processor.analyze_game_from_stream(io.StringIO(scholars_mate_pgn), TEST_PGN_PATH)
         
     # 3. ASSERT - Verify _handle_blunder was called
     assert handle_blunder_mock.called, "_handle_blunder should have been called"
     
-    # Verify that our test detected the specific Nf6 position
-    assert test_analyzer.nf6_move_detected, "The test did not detect the Nf6 move position"
+    # Verify that the position after Nf6 was evaluated
+    evaluated = [board.fen() for board in scholars_mate_analyzer.searches[-1]]
+    assert FEN_AFTER_BLUNDER in evaluated, "The test did not evaluate the Nf6 move position"
     
     # Get the first call arguments
     call_args = handle_blunder_mock.call_args
@@ -139,358 +185,120 @@ def test_blunder_triggers_analysis(mock_stockfish_class, mock_ollama_chat, capsy
     assert analysis['eval_drop'] > 150, f"Eval drop {analysis['eval_drop']} not above threshold"
     assert analysis['move_san'] == 'Nf6', f"Wrong move detected: {analysis['move_san']}, expected Nf6"
 
-@patch('core.analysis.ollama.chat')
-@patch('core.analysis.Stockfish')
-def test_pgn_export_with_comments(mock_stockfish_class, mock_ollama_chat, capsys):
+def test_annotated_game_is_exported_with_comments(scholars_mate_analyzer, scholars_mate_pgn, tmp_path):
     """
     Tests that the annotated PGN is correctly exported with LLM comments.
     """
     # 1. ARRANGE
-    output_pgn_path = os.path.join(TESTS_DIR, "annotated_game.pgn")
     mock_severity = "Blunder"
     mock_motif = "Hanging Piece"
     mock_explanation = "This is a test comment from the mock LLM."
-    mock_llm_json_content = f'{{"severity": "{mock_severity}", "motif": "{mock_motif}", "explanation": "{mock_explanation}"}}'
-    mock_ollama_chat.return_value = {'message': {'content': mock_llm_json_content}}
-
-    mock_stockfish_instance = MagicMock()
-
-    # FEN for the position BEFORE Black's blunder (after 3. Bc4)
-    fen_before_blunder = 'r1bqkbnr/pppp1ppp/2n5/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR b KQkq - 3 3'
-    # FEN for the position AFTER Black's blunder (after 3... Nf6??)
-    fen_after_blunder = 'r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4'
-
-    current_fen = ""
-    def set_fen_side_effect(fen):
-        nonlocal current_fen
-        current_fen = fen
-        print(f"DEBUG - Setting FEN: {fen}")
-        # For debug
-        sys.stderr.write(f"Setting FEN: {fen[:50]}...\n")
-    
-    def get_evaluation_side_effect():
-        if current_fen == fen_before_blunder:
-            return {'type': 'cp', 'value': 50}
-        if current_fen == fen_after_blunder:
-            return {'type': 'cp', 'value': 1000} # Blunder!
-        return {'type': 'cp', 'value': 0}
-
-    mock_stockfish_instance.set_fen_position.side_effect = set_fen_side_effect
-    mock_stockfish_instance.get_evaluation.side_effect = get_evaluation_side_effect
-    # Mock the get_centipawns method to return integer values
-    def get_centipawns_side_effect(evaluation):
-        if evaluation["type"] == "cp":
-            return evaluation["value"]  # Return the actual integer
-        return 0  # Default for other types
-
-    mock_stockfish_instance.get_centipawns.side_effect = get_centipawns_side_effect
-    mock_stockfish_instance.get_best_move.return_value = 'g7g6'
-    mock_stockfish_class.return_value = mock_stockfish_instance
+    db = FakeDatabase()
+    coach = FakeCoach((mock_motif, mock_severity, mock_explanation))
+    processor = GameProcessor(scholars_mate_analyzer, coach, db, 150)
+
+    # The output goes to the test's temporary directory
+    output_pgn_path = tmp_path / "annotated_game.pgn"
 
     # 2. ACT
-    # Create a temporary file for the output
-    with tempfile.NamedTemporaryFile(suffix='.pgn', delete=False) as tmp_file:
-        output_pgn_path = tmp_file.name
-    
-    # Create a GameProcessor with our mocked components
-    db = MagicMock()
-    analyzer = mock_stockfish_instance
-    coach = MagicMock()
-    # Ensure coach.get_analysis returns the expected tuple
-    coach.get_analysis.return_value = ("Missed Tactic", "Medium", "You missed a better move")
-    processor = GameProcessor(analyzer, coach, db, 150)
-    
-    # Mock the LLMCoach load_system_prompt method
-    with patch('core.analysis.LLMCoach._load_system_prompt') as mock_load_prompt:
-        mock_load_prompt.return_value = "You are ChessTacticTagger v1.1."
-        game = processor.analyze_game(TEST_PGN_PATH)
-        
-        # Export the annotated game
-        with open(output_pgn_path, "w", encoding="utf-8") as f:
-            exporter = chess.pgn.FileExporter(f)
-            game.accept(exporter)
+    game = processor.analyze_game_from_stream(io.StringIO(scholars_mate_pgn), TEST_PGN_PATH)
 
-    # 3. ASSERT
-    assert os.path.exists(output_pgn_path)
+    # Export the annotated game
+    with open(output_pgn_path, "w", encoding="utf-8") as f:
+        exporter = chess.pgn.FileExporter(f)
+        game.accept(exporter)
 
+    # 3. ASSERT
     with open(output_pgn_path, 'r') as f:
         # Re-parse the exported game to check its content programmatically
         exported_game = chess.pgn.read_game(f)
     
     assert exported_game is not None, "Could not parse the exported PGN file."
 
-    # Traverse the game to find the move and check for the comment
-    node = exported_game
-    found_comment = False
-    # The blunder is on move 3... Nf6
-    blunder_move_uci = 'g8f6'
-    
-    while node.variations:
-        next_node = node.variations[0]
-        # Check if the node corresponds to the blunder move
-        if node.board().turn == chess.BLACK and node.board().fullmove_number == 3 and next_node.move.uci() == blunder_move_uci:
-            expected_comment = f"[COACH] {mock_severity} ({mock_motif}): {mock_explanation}"
-            assert next_node.comment == expected_comment
-            found_comment = True
+    # Find the blunder move 3... Nf6 on a board played along the mainline, and check its comment
+    board = exported_game.board()
+    for node in exported_game.mainline():
+        if board.fullmove_number == 3 and node.move.uci() == 'g8f6':
+            blunder_node = node
             break
-        node = next_node
-    
-    assert found_comment, f"Comment for the blunder move {blunder_move_uci} was not found."
+        board.push(node.move)
+    else:
+        pytest.fail("The exported game does not contain 3... Nf6")
+    expected_comment = f"[COACH] {mock_severity} ({mock_motif}): {mock_explanation}"
+    assert blunder_node.comment == expected_comment
 
-@patch('core.analysis.ollama.chat')
-@patch('core.analysis.Stockfish')
-def test_blunder_is_saved_to_database(mock_stockfish_class, mock_ollama_chat, capsys):
+def test_blunder_is_saved_to_database(scholars_mate_analyzer, scholars_mate_pgn, db):
     """
     Tests that a detected blunder is correctly saved to the SQLite database.
     """
     # 1. ARRANGE
-    # Create a temporary database file
-    db_fd, db_path = tempfile.mkstemp(suffix=".db")
-    os.close(db_fd)
+    # Mock LLM coach
+    mock_coach = MagicMock()
+    mock_motif = "Hanging Piece"
+    mock_severity = "Blunder"
+    mock_explanation = "This is a test explanation for the database."
+    mock_coach.get_analysis.return_value = (mock_motif, mock_severity, mock_explanation)
     
-    try:
-        # Create a custom StockfishAnalyzer class for testing that returns predetermined evaluations
-        class TestStockfishAnalyzer:
-            def __init__(self):
-                # Define the key FEN positions for the Black blunder
-                self.fen_before_blunder = "r1bqkbnr/pppp1ppp/2n5/4p2Q/2B1P3"  # Position after 3.Bc4
-                self.fen_after_blunder = "r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3"  # Position after 3...Nf6
-                self.current_fen = ""
-                self.nf6_move_detected = False
-                
-            def set_fen_position(self, fen):
-                self.current_fen = fen
-                sys.stderr.write(f"Setting FEN: {fen[:50]}...\n")
-            
-            def get_stockfish_evaluation(self, board):
-                self.current_fen = board.fen()
-                
-                # Check if this is a position after Black's Nf6 move
-                if self.fen_after_blunder in self.current_fen:
-                    sys.stderr.write(f"Detected position AFTER Black's Nf6 blunder\n")
-                    self.nf6_move_detected = True
-                    return {'type': 'cp', 'value': 800}  # Large advantage to White after blunder
-                # Check if this is the position before Black's Nf6 (after White's Bc4)
-                elif self.fen_before_blunder in self.current_fen:
-                    sys.stderr.write(f"Detected position BEFORE Black's Nf6 blunder\n")
-                    return {'type': 'cp', 'value': 50}  # Small advantage to White before blunder
-                # Any other position gets neutral evaluation
-                else:
-                    sys.stderr.write(f"Other position detected: {self.current_fen[:30]}...\n")
-                    return {'type': 'cp', 'value': 0}
-            
-            def get_best_move(self, board):
-                return 'g7g6'  # UCI format for g6 (better move than Nf6)
-            
-            def get_centipawns(self, evaluation):
-                if evaluation['type'] == 'cp':
-                    return evaluation['value']
-                return 0
-                
-            def close(self):
-                pass
-        
-        # Mock LLM coach
-        mock_coach = MagicMock()
-        mock_motif = "Hanging Piece"
-        mock_severity = "Blunder"
-        mock_explanation = "This is a test explanation for the database."
-        mock_coach.get_analysis.return_value = (mock_motif, mock_severity, mock_explanation)
-        
-        # Initialize a real database for testing
-        db = Database(db_path)
-        db.init_db()
+    # 2. ACT - Create processor with the scholar's mate analyzer and analyze the game
+    processor = GameProcessor(scholars_mate_analyzer, mock_coach, db, 150)
+    processor.analyze_game_from_stream(io.StringIO(scholars_mate_pgn), TEST_PGN_PATH)
         
-        # Create our custom test analyzer
-        test_analyzer = TestStockfishAnalyzer()
-        
-        # 2. ACT - Create processor with our custom analyzer and analyze the game
-        with patch('core.analysis.LLMCoach._load_system_prompt'):
-            processor = GameProcessor(test_analyzer, mock_coach, db, 150)
-            processor.analyze_game(TEST_PGN_PATH)
-            
-        # 3. ASSERT - Verify that the blunder was saved to the database
-        saved_blunders = db.get_blunders_by_pgn_path(TEST_PGN_PATH)
-        
-        # Should have exactly one blunder saved
-        assert len(saved_blunders) == 1, f"Incorrect number of blunders saved to the database: {len(saved_blunders)}"
-        
-        # Verify the blunder details match what we expected
-        blunder = saved_blunders[0]
-        assert blunder['player_color'] == 'Black', f"Wrong player color saved: {blunder['player_color']}"
-        assert blunder['move_san'] == 'Nf6', f"Wrong move saved: {blunder['move_san']}"
-        assert blunder['motif'] == mock_motif, f"Wrong motif saved: {blunder['motif']}"
-        assert blunder['severity'] == mock_severity, f"Wrong severity saved: {blunder['severity']}"
-        
-    finally:
-        # Clean up the database file
-        if os.path.exists(db_path):
-            try:
-                db.close()
-                os.unlink(db_path)
-            except Exception as e:
-                sys.stderr.write(f"Error cleaning up database: {e}\n")
-
-@patch('core.analysis.ollama.chat')
-@patch('core.analysis.Stockfish')
-def test_blunder_is_saved_to_database(mock_stockfish_class, mock_ollama_chat, capsys):
-    """
-    Tests that a detected blunder is correctly saved to the SQLite database.
-    """
-    # 1. ARRANGE
-    # Create a temporary database file
-    db_fd, db_path = tempfile.mkstemp(suffix=".db")
-    os.close(db_fd)
+    # 3. ASSERT - Verify that the blunder was saved to the database
+    saved_blunders = db.get_blunders_by_pgn_path(TEST_PGN_PATH)
     
-    try:
-        # Create a custom StockfishAnalyzer class for testing that returns predetermined evaluations
-        class TestStockfishAnalyzer:
-            def __init__(self):
-                # Define the key FEN positions for the Black blunder
-                self.fen_before_blunder = "r1bqkbnr/pppp1ppp/2n5/4p2Q/2B1P3"  # Position after 3.Bc4
-                self.fen_after_blunder = "r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3"  # Position after 3...Nf6
-                self.current_fen = ""
-                self.nf6_move_detected = False
-                
-            def set_fen_position(self, fen):
-                self.current_fen = fen
-                sys.stderr.write(f"Setting FEN: {fen[:50]}...\n")
-            
-            def get_stockfish_evaluation(self, board):
-                self.current_fen = board.fen()
-                
-                # Check if this is a position after Black's Nf6 move
-                if self.fen_after_blunder in self.current_fen:
-                    sys.stderr.write(f"Detected position AFTER Black's Nf6 blunder\n")
-                    self.nf6_move_detected = True
-                    return {'type': 'cp', 'value': 800}  # Large advantage to White after blunder
-                # Check if this is the position before Black's Nf6 (after White's Bc4)
-                elif self.fen_before_blunder in self.current_fen:
-                    sys.stderr.write(f"Detected position BEFORE Black's Nf6 blunder\n")
-                    return {'type': 'cp', 'value': 50}  # Small advantage to White before blunder
-                # Any other position gets neutral evaluation
-                else:
-                    sys.stderr.write(f"Other position detected: {self.current_fen[:30]}...\n")
-                    return {'type': 'cp', 'value': 0}
-            
-            def get_best_move(self, board):
-                return 'g7g6'  # UCI format for g6 (better move than Nf6)
-            
-            def get_centipawns(self, evaluation):
-                if evaluation['type'] == 'cp':
-                    return evaluation['value']
-                return 0
-                
-            def close(self):
-                pass
-        
-        # Mock LLM coach
-        mock_coach = MagicMock()
-        mock_motif = "Hanging Piece"
-        mock_severity = "Blunder"
-        mock_explanation = "This is a test explanation for the database."
-        mock_coach.get_analysis.return_value = (mock_motif, mock_severity, mock_explanation)
-        
-        # Initialize a real database for testing
-        db = Database(db_path)
-        db.init_db()
-        
-        # Create our custom test analyzer
-        test_analyzer = TestStockfishAnalyzer()
-        
-        # 2. ACT - Create processor with our custom analyzer and analyze the game
-        with patch('core.analysis.LLMCoach._load_system_prompt'):
-            processor = GameProcessor(test_analyzer, mock_coach, db, 150)
-            processor.analyze_game(TEST_PGN_PATH)
-            
-        # 3. ASSERT - Verify that the blunder was saved to the database
-        saved_blunders = db.get_blunders_by_pgn_path(TEST_PGN_PATH)
-        
-        # Should have exactly one blunder saved
-        assert len(saved_blunders) == 1, f"Incorrect number of blunders saved to the database: {len(saved_blunders)}"
-        
-        # Verify the blunder details match what we expected
-        blunder = saved_blunders[0]
-        assert blunder['player_color'] == 'Black', f"Wrong player color saved: {blunder['player_color']}"
-        assert blunder['move_san'] == 'Nf6', f"Wrong move saved: {blunder['move_san']}"
-        assert blunder['motif'] == mock_motif, f"Wrong motif saved: {blunder['motif']}"
-        assert blunder['severity'] == mock_severity, f"Wrong severity saved: {blunder['severity']}"
-        
-    finally:
-        # Clean up the database file
-        if os.path.exists(db_path):
-            try:
-                db.close()
-                os.unlink(db_path)
-            except Exception as e:
-                sys.stderr.write(f"Error cleaning up database: {e}\n")
+    # Should have exactly one blunder saved
+    assert len(saved_blunders) == 1, f"Incorrect number of blunders saved to the database: {len(saved_blunders)}"
+    
+    # Verify the blunder details match what we expected
+    blunder = saved_blunders[0]
+    assert blunder['player_color'] == 'Black', f"Wrong player color saved: {blunder['player_color']}"
+    assert blunder['move_san'] == 'Nf6', f"Wrong move saved: {blunder['move_san']}"
+    assert blunder['motif'] == mock_motif, f"Wrong motif saved: {blunder['motif']}"
+    assert blunder['severity'] == mock_severity, f"Wrong severity saved: {blunder['severity']}"
 
 # Get the absolute path to the new test PGN file
 BLUNDERS_PGN_PATH = os.path.join(TESTS_DIR, 'blunders_both_sides.pgn')
 
-@pytest.mark.parametrize("side_to_analyze, expected_white_calls, expected_black_calls", [
-    ("white", 1, 0),  # Only White blunders should be processed
-    ("black", 0, 1),  # Only Black blunders should be processed
-    ("both", 1, 1),   # Both White and Black blunders should be processed
-])
-@patch('core.analysis.ollama.chat')
-@patch('core.analysis.Stockfish')
-def test_side_specific_blunder_filtering(
-    mock_stockfish_class, mock_ollama_chat, capsys,
-    side_to_analyze, expected_white_calls, expected_black_calls
-):
-    """
-    Test that side-specific blunder filtering works correctly during game analysis.
-    This tests that blunders are only processed for the specified side(s).
+# Evaluations of 1. e4 e5 2. Nf3 Nc6 keyed by piece placement - ensure only one blunder per side
+BOTH_SIDES_EVALUATIONS = {
+    # Initial position
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR": {'type': 'cp', 'value': 20},
+    # After 1.e4 (White's move) - White blunder with big drop
+    "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR": {'type': 'cp', 'value': -200},
+    # After 1...e5 (Black's move) - Black blunder with big rise
+    "rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR": {'type': 'cp', 'value': 200},
+    # After 2.Nf3 (White's move) - small change, NOT a blunder (only 30cp drop)
+    "rnbqkbnr/pppp1ppp/8/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R": {'type': 'cp', 'value': 170},
+    # After 2...Nc6 (Black's move) - small change, NOT a blunder (only 50cp rise)
+    "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R": {'type': 'cp', 'value': 220}
+}
+
+def test_blunders_of_both_sides_are_handled(tmp_path):
+    """
+    Test that analyzing both sides handles exactly one blunder of each side in a
+    single pass; filtering by side is covered by test_side_specific.py.
     """
     # ARRANGE
-    # Setup mock for LLM response
-    mock_ollama_chat.return_value = {'message': {'content': '{"motif": "Test", "severity": "High", "explanation": "Test explanation"}'}}
-    
     # Create a simple PGN for testing with moves that will trigger both White and Black blunders
-    with tempfile.NamedTemporaryFile(suffix='.pgn', delete=False) as tmp_file:
-        tmp_file.write(b"[Event \"Test Game\"]\n[White \"Player A\"]\n[Black \"Player B\"]\n\n1. e4 e5 2. Nf3 Nc6 *")
-        test_pgn_path = tmp_file.name
+    test_pgn_path = tmp_path / "game.pgn"
+    test_pgn_path.write_bytes(b"[Event \"Test Game\"]\n[White \"Player A\"]\n[Black \"Player B\"]\n\n1. e4 e5 2. Nf3 Nc6 *")
     
     # Create a mock Stockfish analyzer that returns evaluations triggering blunders for both sides
-    mock_stockfish_instance = MagicMock()
-    
-    # Track which positions have been evaluated - ensure only one blunder per side
-    eval_sequence = {
-        # Initial position
-        "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq -": {'type': 'cp', 'value': 20},
-        # After 1.e4 (White's move) - White blunder with big drop
-        "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq -": {'type': 'cp', 'value': -200},
-        # After 1...e5 (Black's move) - Black blunder with big rise
-        "rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq -": {'type': 'cp', 'value': 200},
-        # After 2.Nf3 (White's move) - small change, NOT a blunder (only 30cp drop)
-        "rnbqkbnr/pppp1ppp/8/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R b KQkq -": {'type': 'cp', 'value': 170},
-        # After 2...Nc6 (Black's move) - small change, NOT a blunder (only 50cp rise)
-        "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq -": {'type': 'cp', 'value': 220}
-    }
+    mock_stockfish_instance = create_autospec(StockfishAnalyzer, instance=True)
+    
+    default_evaluation = {'type': 'cp', 'value': 0}
     
     def mock_get_evaluation(board):
-        # Simplified FEN matching (just piece placement)
-        fen_simplified = board.fen().split(' ')[0]
-        # Find a matching FEN pattern (may need to be more robust in real tests)
-        for pattern, eval_dict in eval_sequence.items():
-            pattern_simplified = pattern.split(' ')[0]
-            if fen_simplified == pattern_simplified:
-                return eval_dict
-        # Default evaluation if no match
-        return {'type': 'cp', 'value': 0}
+        return BOTH_SIDES_EVALUATIONS.get(board.board_fen(), default_evaluation)
     
     mock_stockfish_instance.get_stockfish_evaluation.side_effect = mock_get_evaluation
+    mock_stockfish_instance.evaluate_positions.side_effect = lambda boards: [mock_get_evaluation(b) for b in boards]
     mock_stockfish_instance.get_centipawns.side_effect = lambda e: e['value'] if e['type'] == 'cp' else 0
     mock_stockfish_instance.get_best_move.return_value = 'd2d4'  # Default best move
-    mock_stockfish_class.return_value = mock_stockfish_instance
-    
-    # Create a database mock
-    mock_db = MagicMock()
     
-    # Create a coach mock
-    mock_coach = MagicMock()
-    mock_coach.get_analysis.return_value = ("Test Motif", "High", "Test explanation")
+    # Create database and coach stubs; only _handle_blunder is inspected
+    mock_db = FakeDatabase()
+    mock_coach = FakeCoach(("Test Motif", "High", "Test explanation"))
     
     # ACT
     # Create the GameProcessor with our mocks
@@ -503,8 +311,8 @@ def test_side_specific_blunder_filtering(
     
     # Patch the _handle_blunder method to track calls
     with patch.object(GameProcessor, '_handle_blunder') as mock_handle_blunder:
-        # Process the game with the specified side_to_analyze
-        processor.analyze_game(test_pgn_path, side_to_analyze=side_to_analyze)
+        # Process the game for both sides at once
+        processor.analyze_game(test_pgn_path, side_to_analyze='both')
         
         # ASSERT
         # Count the calls to _handle_blunder for White and Black separately
@@ -519,27 +327,19 @@ def test_side_specific_blunder_filtering(
             elif analysis['player_color'] == 'Black':
                 black_blunder_calls += 1
         
-        # Verify the correct number of calls for each side
-        assert white_blunder_calls == expected_white_calls, \
-            f"Expected {expected_white_calls} White blunder calls, got {white_blunder_calls}"
-        assert black_blunder_calls == expected_black_calls, \
-            f"Expected {expected_black_calls} Black blunder calls, got {black_blunder_calls}"
-    
-    # Clean up
-    os.unlink(test_pgn_path)
+        # Verify that each side's blunder was handled once
+        assert white_blunder_calls == 1, f"Expected 1 White blunder call, got {white_blunder_calls}"
+        assert black_blunder_calls == 1, f"Expected 1 Black blunder call, got {black_blunder_calls}"
 
-@patch('core.analysis.ollama.chat')
-@patch('core.analysis.Stockfish')
-def test_pgn_export_with_comments(mock_stockfish_class, mock_ollama_chat, capsys):
+def test_pgn_comment_roundtrip(tmp_path):
     """
-    Tests that the annotated PGN is correctly exported with LLM comments.
+    Tests that a coach comment survives exporting a game to PGN and reading it back.
     Uses a simplified approach that directly adds a comment to the game.
     """
     # 1. ARRANGE
     mock_severity = "Blunder"
     mock_motif = "Hanging Piece"
     mock_explanation = "This is a test comment from the mock LLM."
-    mock_ollama_chat.return_value = {'message': {'content': f'{{"severity": "{mock_severity}", "motif": "{mock_motif}", "explanation": "{mock_explanation}"}}'}}
     
     # Create a game and node for testing
     game = chess.pgn.Game()
@@ -549,89 +349,759 @@ def test_pgn_export_with_comments(mock_stockfish_class, mock_ollama_chat, capsys
     # Add a variation to the game
     node = game.add_variation(chess.Move.from_uci("e2e4"))
     
-    # Create a temporary file for the output
-    with tempfile.NamedTemporaryFile(suffix='.pgn', delete=False) as tmp_file:
-        output_pgn_path = tmp_file.name
+    # The output goes to the test's temporary directory
+    output_pgn_path = tmp_path / "annotated_game.pgn"
     
-    try:
-        # Manually add a comment to the move
-        expected_comment = f"[COACH] {mock_severity} ({mock_motif}): {mock_explanation}"
-        node.comment = expected_comment
-        
-        # Export the annotated game
-        with open(output_pgn_path, "w", encoding="utf-8") as f:
-            exporter = chess.pgn.FileExporter(f)
-            game.accept(exporter)
+    # Manually add a comment to the move
+    expected_comment = f"[COACH] {mock_severity} ({mock_motif}): {mock_explanation}"
+    node.comment = expected_comment
+    
+    # Export the annotated game
+    with open(output_pgn_path, "w", encoding="utf-8") as f:
+        exporter = chess.pgn.FileExporter(f)
+        game.accept(exporter)
 
-        # 3. ASSERT - Verify the comment is in the exported PGN
-        assert os.path.exists(output_pgn_path), "Output PGN file was not created"
+    # 3. ASSERT - Verify the comment is in the exported PGN
+    assert os.path.exists(output_pgn_path), "Output PGN file was not created"
 
-        # Read the file contents and check for the comment
-        with open(output_pgn_path, 'r', encoding='utf-8') as f:
-            pgn_content = f.read()
-        
-        assert expected_comment in pgn_content, f"Comment not found in exported PGN file. Content: {pgn_content}"
+    # Read the file contents and check for the comment
+    with open(output_pgn_path, 'r', encoding='utf-8') as f:
+        pgn_content = f.read()
+    
+    assert expected_comment in pgn_content, f"Comment not found in exported PGN file. Content: {pgn_content}"
 
-        # Re-parse the exported game to check its content programmatically
-        with open(output_pgn_path, 'r') as f:
-            exported_game = chess.pgn.read_game(f)
-        
-        assert exported_game is not None, "Could not parse the exported PGN file."
+    # Re-parse the exported game to check its content programmatically
+    with open(output_pgn_path, 'r') as f:
+        exported_game = chess.pgn.read_game(f)
+    
+    assert exported_game is not None, "Could not parse the exported PGN file."
 
-        # Check if the comment is preserved in the parsed game
-        assert exported_game.variations[0].comment == expected_comment, "Comment not preserved in parsed game"
+    # Check if the comment is preserved in the parsed game
+    assert exported_game.variations[0].comment == expected_comment, "Comment not preserved in parsed game"
 
-    finally:
-        # Clean up the temporary file
-        if os.path.exists(output_pgn_path):
-            try:
-                os.unlink(output_pgn_path)
-            except Exception as e:
-                print(f"Error cleaning up PGN file: {e}")
 
 
-@patch('core.analysis.ollama.chat')
-def test_json_parsing_with_markdown_fences(mock_ollama_chat, capsys):
+def test_json_parsing_with_markdown_fences(mock_ollama_chat):
     """
     Tests that the JSON response is correctly parsed even when wrapped
     in markdown code fences (e.g., ```json ... ```).
     """
     # 1. ARRANGE
-    mock_motif = "Missed Tactic"
-    mock_severity = "Inaccuracy"
-    mock_explanation = "This is a test explanation inside a markdown block."
+    mock_motif, mock_severity, mock_explanation = FENCED_FEEDBACK
     
     # Simulate the LLM wrapping its response in a markdown code block
-    raw_llm_content = f"```json\n{{\n  \"motif\": \"{mock_motif}\",\n  \"severity\": \"{mock_severity}\",\n  \"explanation\": \"{mock_explanation}\"\n}}\n```"
-    mock_ollama_chat.return_value = {'message': {'content': raw_llm_content}}
+    mock_ollama_chat.return_value = _FENCED_RESPONSE
     
     # 2. ACT - Create an LLMCoach instance and directly test its get_analysis method
-    with patch('os.path.exists') as mock_exists:
-        # Mock path exists check for system prompt
-        mock_exists.return_value = True
-        
-        with patch('builtins.open', mock_open(read_data="Test system prompt")) as mock_file:
-            # Create an LLMCoach instance
-            coach = LLMCoach(model="test_model", system_prompt_path="test_path.txt")
-            
-            # Call get_analysis which will use our mocked ollama.chat
-            motif, severity, explanation = coach.get_analysis(
-                position_fen="test_fen",
-                move_san="e4",
-                best_move_san="e5",
-                cp_loss=150,
-                mate_missed=False
-            )
+    coach = LLMCoach(model="test_model", system_prompt_path=SYSTEM_PROMPT_PATH)
+    
+    # Call get_analysis which will use our mocked Client.chat
+    motif, severity, explanation = coach.get_analysis(
+        position_fen="test_fen",
+        move_san="e4",
+        best_move_san="e5",
+        cp_loss=150,
+        mate_missed=False
+    )
     
     # 3. ASSERT - Check that JSON was correctly parsed even with markdown fences
     assert motif == mock_motif, f"Expected motif '{mock_motif}', got '{motif}'"
     assert severity == mock_severity, f"Expected severity '{mock_severity}', got '{severity}'"
     assert explanation == mock_explanation, f"Expected explanation '{mock_explanation}', got '{explanation}'"
     
-    # Verify that ollama.chat was called with the expected arguments
+    # Verify that Client.chat was called with the expected arguments
     mock_ollama_chat.assert_called_once()
     call_args = mock_ollama_chat.call_args[1]
     assert call_args['model'] == "test_model"
     assert len(call_args['messages']) == 2
     assert call_args['messages'][0]['role'] == 'system'
     assert call_args['messages'][1]['role'] == 'user'
+    assert call_args['format']['required'] == ['motif', 'severity', 'explanation']
+    assert call_args['options']['num_predict'] == 256
+
+
+@patch('core.analysis.chess.engine.SimpleEngine.popen_uci')
+def test_stockfish_analyzer_returns_score_and_best_move(mock_popen_uci):
+    """
+    Tests that a single engine search yields both the evaluation and the best move,
+    and that the engine process is reused and shut down on close.
+    """
+    # 1. ARRANGE
+    mock_engine = mock_popen_uci.return_value
+    mock_engine.analyse.return_value = {
+        'score': chess.engine.PovScore(chess.engine.Cp(-35), chess.BLACK),
+        'pv': [chess.Move.from_uci('g8f6'), chess.Move.from_uci('d2d4')],
+        'depth': 12
+    }
+    board = chess.Board('rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 2')
+
+    # 2. ACT
+    analyzer = StockfishAnalyzer(stockfish_path=ENGINE_PATH, depth=12)
+    evaluation = analyzer.get_stockfish_evaluation(board)
+    analyzer.get_stockfish_evaluation(board)
+    analyzer.close()
+
+    # 3. ASSERT
+    assert evaluation == {'type': 'cp', 'value': 35, 'best_move': 'g8f6', 'depth': 12}
+    mock_popen_uci.assert_called_once_with(ENGINE_PATH)
+    assert mock_engine.analyse.call_count == 2
+    assert mock_engine.analyse.call_args[0][1] == chess.engine.Limit(depth=12)
+    mock_engine.quit.assert_called_once()
+
+
+@patch('core.analysis.chess.engine.SimpleEngine.popen_uci')
+def test_mate_on_the_board_keeps_the_winner(mock_popen_uci):
+    """
+    Tests that a checkmated position, which the engine reports as "mate 0"
+    without a sign, is scored for the side that delivered the mate.
+    """
+    # 1. ARRANGE
+    mock_engine = mock_popen_uci.return_value
+    analyzer = StockfishAnalyzer(stockfish_path=ENGINE_PATH, depth=12)
+    white_mated = chess.Board('rnb1kbnr/pppp1ppp/8/4p3/6Pq/5P2/PPPPP2P/RNBQKBNR w KQkq - 1 3')
+    black_mated = chess.Board('r1bqkb1r/pppp1Qpp/2n2n2/4p3/2B1P3/8/PPPP1PPP/RNB1K1NR b KQkq - 0 4')
+
+    # 2. ACT
+    mock_engine.analyse.return_value = {'score': chess.engine.PovScore(chess.engine.Mate(0), chess.WHITE)}
+    white_mated_evaluation = analyzer.get_stockfish_evaluation(white_mated)
+    mock_engine.analyse.return_value = {'score': chess.engine.PovScore(chess.engine.Mate(0), chess.BLACK)}
+    black_mated_evaluation = analyzer.get_stockfish_evaluation(black_mated)
+
+    # 3. ASSERT
+    assert StockfishAnalyzer.get_centipawns(white_mated_evaluation) == -StockfishAnalyzer.MATE_SCORE
+    assert StockfishAnalyzer.get_centipawns(black_mated_evaluation) == StockfishAnalyzer.MATE_SCORE
+
+
+def test_each_position_is_evaluated_once(scholars_mate_pgn):
+    """
+    Tests that every position of the game is sent to the analyzer in a single
+    batch, one search per position before the last move, so a game with N
+    plies ending in checkmate costs N engine searches; its final position
+    is scored without the engine.
+    """
+    # 1. ARRANGE
+    analyzer = create_autospec(StockfishAnalyzer, instance=True)
+    analyzer.evaluate_positions.side_effect = lambda boards: [{'type': 'cp', 'value': 0}] * len(boards)
+    analyzer.get_centipawns.side_effect = StockfishAnalyzer.get_centipawns
+    processor = GameProcessor(analyzer, MagicMock(), MagicMock(), 150)
+
+    # 2. ACT
+    game = processor.analyze_game_from_stream(io.StringIO(scholars_mate_pgn), TEST_PGN_PATH)
+
+    # 3. ASSERT
+    analyzer.evaluate_positions.assert_called_once()
+    positions = analyzer.evaluate_positions.call_args[0][0]
+    ply_count = len(list(game.mainline_moves()))
+    assert game.end().board().is_checkmate()
+    assert len(positions) == ply_count
+    assert positions[0] == game.board()
+    assert positions[-1] == game.end().parent.board()
+    analyzer.get_stockfish_evaluation.assert_not_called()
+
+
+@patch('core.analysis.os.cpu_count', return_value=4)
+@patch('core.analysis.StockfishAnalyzer')
+def test_stockfish_pool_evaluates_positions_in_order(mock_analyzer_class, mock_cpu_count):
+    """
+    Tests that the pool starts one single-threaded engine per worker, splits a
+    batch into contiguous runs of positions, several per engine, and returns the
+    evaluations of a batch in the order of the positions.
+    """
+    # 1. ARRANGE
+    engines = [MagicMock(), MagicMock()]
+    for engine in engines:
+        engine.get_stockfish_evaluation.side_effect = lambda board, depth: {'type': 'cp', 'value': board.ply()}
+    mock_analyzer_class.side_effect = engines
+    boards = [chess.Board()]
+    for uci in ['e2e4', 'e7e5', 'g1f3', 'b8c6', 'f1c4', 'f8c5', 'c2c3', 'g8f6', 'd2d4']:
+        boards.append(boards[-1].copy())
+        boards[-1].push_uci(uci)
+
+    # 2. ACT
+    pool = StockfishPool(stockfish_path="mock_stockfish", size=2, depth=12)
+    with patch.object(pool, '_evaluate_run', wraps=pool._evaluate_run) as evaluate_run:
+        evaluations = pool.evaluate_positions(boards)
+    pool.close()
+
+    # 3. ASSERT
+    assert [e['value'] for e in evaluations] == list(range(10))
+    runs = sorted([board.ply() for board in c.args[0]] for c in evaluate_run.call_args_list)
+    assert runs == [[0, 1], [2, 3], [4, 5], [6, 7], [8, 9]]
+    searched = sorted(c.args[0].ply() for engine in engines for c in engine.get_stockfish_evaluation.call_args_list)
+    assert searched == list(range(10))
+    assert mock_analyzer_class.call_count == 2
+    assert mock_analyzer_class.call_args.kwargs['threads'] == 1
+    for engine in engines:
+        engine.close.assert_called_once()
+
+
+@patch('core.analysis.os.cpu_count', return_value=8)
+@patch('core.analysis.StockfishAnalyzer')
+def test_single_engine_pool_searches_on_every_core(mock_analyzer_class, mock_cpu_count):
+    """
+    Tests that a pool of one engine gives it a thread per physical core, while
+    the default pool runs one single-threaded engine per core.
+    """
+    # 1. ACT
+    StockfishPool(stockfish_path="mock_stockfish", size=1).close()
+    single_engine_threads = mock_analyzer_class.call_args.kwargs['threads']
+    mock_analyzer_class.reset_mock()
+    StockfishPool(stockfish_path="mock_stockfish").close()
+
+    # 2. ASSERT
+    assert single_engine_threads == 4
+    assert mock_analyzer_class.call_count == 4
+    assert mock_analyzer_class.call_args.kwargs['threads'] == 1
+
+
+def test_screening_pass_re_searches_only_candidate_plies(scholars_mate_pgn):
+    """
+    Tests that with a screen depth, every position is searched shallowly first and
+    only the positions around a suspected mistake are searched again at full depth.
+    """
+    # 1. ARRANGE
+    def evaluate_positions(boards, depth=None):
+        # Position 6 (after 3...Nf6) looks bad in the quick pass and is confirmed by the deep pass
+        evaluations = []
+        for board in boards:
+            if board.ply() == 6:
+                evaluations.append({'type': 'cp', 'value': 800 if depth else 900})
+            else:
+                evaluations.append({'type': 'cp', 'value': 0, 'best_move': 'g7g6'})
+        return evaluations
+
+    analyzer = create_autospec(StockfishAnalyzer, instance=True)
+    analyzer.evaluate_positions.side_effect = evaluate_positions
+    analyzer.get_centipawns.side_effect = StockfishAnalyzer.get_centipawns
+    coach = MagicMock()
+    coach.get_analysis.return_value = ("Test Motif", "Test Severity", "Mock analysis")
+    processor = GameProcessor(analyzer, coach, MagicMock(), 150, screen_depth=8)
+
+    # 2. ACT
+    with patch.object(GameProcessor, '_handle_blunder') as handle_blunder_mock:
+        processor.analyze_game_from_stream(io.StringIO(scholars_mate_pgn), TEST_PGN_PATH)
+
+    # 3. ASSERT
+    screen_call, deep_call = analyzer.evaluate_positions.call_args_list
+    assert screen_call.kwargs == {'depth': 8}
+    assert [board.ply() for board in deep_call.args[0]] == [5, 6]
+    analysis = handle_blunder_mock.call_args[0][0]
+    assert analysis['move_san'] == 'Nf6'
+    assert analysis['eval_drop'] == 900
+
+
+def test_screening_confirms_the_ply_next_to_a_candidate_at_full_depth():
+    """
+    Tests that a quiet ply next to a candidate is searched at full depth when
+    comparing its quick evaluation with the candidate's deep one would make it
+    look like a mistake.
+    """
+    # 1. ARRANGE
+    def evaluate_positions(boards, depth=None):
+        # 2. Nf3 loses 100 centipawns in the quick pass and 400 at full depth;
+        # 2...Nc6 changes nothing at either depth
+        return [{'type': 'cp', 'value': (-100 if depth else -400) if board.ply() >= 3 else 0,
+                 'best_move': 'd2d4'} for board in boards]
+
+    analyzer = create_autospec(StockfishAnalyzer, instance=True)
+    analyzer.evaluate_positions.side_effect = evaluate_positions
+    analyzer.get_centipawns.side_effect = StockfishAnalyzer.get_centipawns
+    coach = MagicMock()
+    coach.get_analysis.return_value = ("Test Motif", "Test Severity", "Mock analysis")
+    db = MagicMock()
+    processor = GameProcessor(analyzer, coach, db, 150, screen_depth=8)
+
+    # 2. ACT
+    processor.analyze_game_from_stream(io.StringIO("1. e4 e5 2. Nf3 Nc6 *"), "game-id")
+
+    # 3. ASSERT
+    deep_calls = analyzer.evaluate_positions.call_args_list[1:]
+    assert [[board.ply() for board in c.args[0]] for c in deep_calls] == [[2, 3], [4]]
+    saved = db.save_blunders.call_args.args[0]
+    assert [(b['move_san'], b['eval_drop']) for b in saved] == [('Nf3', 400)]
+
+
+def test_decided_plies_are_neither_re_searched_nor_reported(scholars_mate_pgn):
+    """
+    Tests that with a screen depth, a ply leaving the same side decisively ahead
+    keeps its quick evaluations and is not reported, however much it drops.
+    """
+    # 1. ARRANGE
+    def evaluate_positions(boards, depth=None):
+        # White is winning throughout, but 3. Bc4 cuts the lead from 3000 to 1600
+        return [{'type': 'cp', 'value': 1600 if board.ply() >= 5 else 3000, 'best_move': 'g7g6'}
+                for board in boards]
+
+    analyzer = create_autospec(StockfishAnalyzer, instance=True)
+    analyzer.evaluate_positions.side_effect = evaluate_positions
+    analyzer.get_centipawns.side_effect = StockfishAnalyzer.get_centipawns
+    coach = MagicMock()
+    db = MagicMock()
+    processor = GameProcessor(analyzer, coach, db, 150, screen_depth=8)
+
+    # 2. ACT
+    processor.analyze_game_from_stream(io.StringIO(scholars_mate_pgn), TEST_PGN_PATH)
+
+    # 3. ASSERT
+    searches = [[board.ply() for board in c.args[0]] for c in analyzer.evaluate_positions.call_args_list]
+    assert searches == [[0, 1, 2, 3, 4, 5, 6]]
+    coach.get_analysis.assert_not_called()
+    db.save_blunders.assert_not_called()
+
+
+def test_cached_analyzer_only_searches_uncached_positions(db):
+    """
+    Tests that evaluations are persisted per position and engine, reused for
+    searches of equal or lower depth and best move lookups, and replaced by
+    deeper searches.
+    """
+    # 1. ARRANGE
+    inner = create_autospec(StockfishAnalyzer, instance=True)
+    inner.depth = 18
+    inner.nodes = None
+    inner.engine_name = "Stockfish Test"
+    inner.evaluate_positions.side_effect = lambda boards, depth: [
+        {'type': 'cp', 'value': depth or 18, 'best_move': 'e2e4'} for _ in boards]
+    boards = [chess.Board()]
+    boards.append(boards[0].copy())
+    boards[1].push_uci('e2e4')
+
+    # 2. ACT
+    analyzer = CachedAnalyzer(inner, db)
+    first = analyzer.evaluate_positions(boards)
+    second = analyzer.evaluate_positions(boards, depth=12)
+    deeper = analyzer.evaluate_positions(boards[:1], depth=20)
+    repeated = analyzer.evaluate_positions(boards[:1], depth=20)
+
+    # 3. ASSERT
+    assert first == second == [{'type': 'cp', 'value': 18, 'best_move': 'e2e4'}] * 2
+    assert deeper == repeated == [{'type': 'cp', 'value': 20, 'best_move': 'e2e4'}]
+    assert [len(c.args[0]) for c in inner.evaluate_positions.call_args_list] == [2, 1]
+    assert analyzer.get_best_move(boards[1]) == 'e2e4'
+    inner.get_best_move.assert_not_called()
+
+
+def test_cached_analyzer_does_not_trust_searches_cut_short_by_the_node_budget(db):
+    """
+    Tests that an entry whose search ran out of nodes before the requested depth
+    only counts as deep for the same or a smaller node budget, and as deep as it
+    reached for any budget.
+    """
+    # 1. ARRANGE
+    def make_analyzer(nodes):
+        inner = create_autospec(StockfishAnalyzer, instance=True)
+        inner.depth = 18
+        inner.nodes = nodes
+        inner.engine_name = "Stockfish Test"
+        # The budget runs out at depth 14
+        inner.evaluate_positions.side_effect = lambda boards, depth: [
+            {'type': 'cp', 'value': 30, 'best_move': 'e2e4', 'depth': 14} for _ in boards]
+        return inner
+    board = chess.Board()
+
+    # 2. ACT
+    limited, same, smaller, larger = (make_analyzer(n) for n in (500_000, 500_000, 100_000, 2_000_000))
+    CachedAnalyzer(limited, db).evaluate_positions([board])
+    CachedAnalyzer(same, db).evaluate_positions([board])
+    CachedAnalyzer(smaller, db).evaluate_positions([board])
+    CachedAnalyzer(larger, db).evaluate_positions([board], depth=14)
+    CachedAnalyzer(larger, db).evaluate_positions([board])
+
+    # 3. ASSERT
+    assert [inner.evaluate_positions.call_count for inner in (limited, same, smaller, larger)] == [1, 0, 0, 1]
+
+
+def test_blunders_are_coached_concurrently(tmp_path):
+    """
+    Tests that all blunders of a game are sent to the LLM coach concurrently and
+    that each blunder is saved with its own feedback.
+    """
+    # 1. ARRANGE
+    pgn_path = tmp_path / "game.pgn"
+    pgn_path.write_text("1. e4 e5 *")
+
+    analyzer = create_autospec(StockfishAnalyzer, instance=True)
+    analyzer.evaluate_positions.return_value = [
+        {'type': 'cp', 'value': 0, 'best_move': 'd2d4'},
+        {'type': 'cp', 'value': -300, 'best_move': 'd7d5'},
+        {'type': 'cp', 'value': 300},
+    ]
+    analyzer.get_centipawns.side_effect = StockfishAnalyzer.get_centipawns
+
+    # Both requests must be in flight at the same time to get past the barrier
+    barrier = threading.Barrier(2, timeout=5)
+    def get_analysis(**context):
+        barrier.wait()
+        return ("Motif", "Blunder", f"Feedback for {context['move_san']}")
+    coach = MagicMock()
+    coach.get_analysis.side_effect = get_analysis
+    db = MagicMock()
+
+    # 2. ACT
+    processor = GameProcessor(analyzer, coach, db, 150, llm_workers=2)
+    processor.analyze_game(pgn_path)
+
+    # 3. ASSERT
+    assert coach.get_analysis.call_count == 2
+    db.save_blunders.assert_called_once()
+    saved = {b['move_san']: b['coach_comment'] for b in db.save_blunders.call_args.args[0]}
+    assert saved == {'e4': "Feedback for e4", 'e5': "Feedback for e5"}
+
+
+def test_game_is_analyzed_from_stream():
+    """
+    Tests that a game can be analyzed straight from a text stream and that its
+    blunders are stored under the given identifier.
+    """
+    # 1. ARRANGE
+    analyzer = create_autospec(StockfishAnalyzer, instance=True)
+    analyzer.evaluate_positions.return_value = [
+        {'type': 'cp', 'value': 0, 'best_move': 'd2d4'},
+        {'type': 'cp', 'value': -300},
+    ]
+    analyzer.get_centipawns.side_effect = StockfishAnalyzer.get_centipawns
+    coach = MagicMock()
+    coach.get_analysis.return_value = ("Motif", "Blunder", "Feedback")
+    db = MagicMock()
+
+    # 2. ACT
+    processor = GameProcessor(analyzer, coach, db, 150)
+    game = processor.analyze_game_from_stream(io.StringIO("1. e4 *"), "game-id")
+
+    # 3. ASSERT
+    assert [move.uci() for move in game.mainline_moves()] == ['e2e4']
+    db.save_blunders.assert_called_once()
+    assert [b['pgn_path'] for b in db.save_blunders.call_args.args[0]] == ["game-id"]
+
+
+def test_forced_moves_are_never_mistakes():
+    """
+    Tests that a move that was the only legal one is not reported, however
+    much the evaluation drops.
+    """
+    # 1. ARRANGE
+    # The black rook on a2 leaves the white king a single move, Kg1
+    pgn = '[FEN "k7/8/8/8/8/8/r7/7K w - - 0 1"]\n[SetUp "1"]\n\n1. Kg1 *'
+    analyzer = create_autospec(StockfishAnalyzer, instance=True)
+    analyzer.evaluate_positions.return_value = [
+        {'type': 'cp', 'value': 0, 'best_move': 'h1g1'},
+        {'type': 'cp', 'value': -500},
+    ]
+    analyzer.get_centipawns.side_effect = StockfishAnalyzer.get_centipawns
+    coach = MagicMock()
+    db = MagicMock()
+
+    # 2. ACT
+    processor = GameProcessor(analyzer, coach, db, 150, screen_depth=10)
+    processor.analyze_game_from_stream(io.StringIO(pgn), "game-id")
+
+    # 3. ASSERT
+    # The forced move was screened but not searched again at full depth
+    searches = [[board.ply() for board in c.args[0]] for c in analyzer.evaluate_positions.call_args_list]
+    assert searches == [[0, 1]]
+    coach.get_analysis.assert_not_called()
+    db.save_blunders.assert_not_called()
+
+
+def test_opening_book_plies_are_not_searched(tmp_path):
+    """
+    Tests that the positions reached by moves from the opening book are not sent
+    to the engine and that book moves are never flagged as mistakes.
+    """
+    # 1. ARRANGE
+    # A Polyglot book with a single entry: 1. e4 from the starting position
+    e2e4 = (3 << 3) | 4 | (4 << 6) | (1 << 9)
+    book_path = tmp_path / "book.bin"
+    book_path.write_bytes(struct.pack(">QHHI", chess.polyglot.zobrist_hash(chess.Board()), e2e4, 1, 0))
+
+    analyzer = create_autospec(StockfishAnalyzer, instance=True)
+    analyzer.evaluate_positions.side_effect = lambda boards: [{'type': 'cp', 'value': 40}] * len(boards)
+    analyzer.get_centipawns.side_effect = StockfishAnalyzer.get_centipawns
+    db = MagicMock()
+
+    # 2. ACT
+    processor = GameProcessor(analyzer, MagicMock(), db, 150, opening_book_path=book_path)
+    processor.analyze_game_from_stream(io.StringIO("1. e4 e5 *"), "game-id")
+
+    # 3. ASSERT
+    positions = analyzer.evaluate_positions.call_args[0][0]
+    assert [board.ply() for board in positions] == [1, 2]
+    db.save_blunders.assert_not_called()
+
+
+def test_eval_drops_are_taken_from_the_mover_perspective():
+    """
+    Tests that the eval drop of every ply is computed from the perspective of
+    the player who moved, including mate scores.
+    """
+    # 1. ARRANGE
+    analyzer = create_autospec(StockfishAnalyzer, instance=True)
+    analyzer.get_centipawns.side_effect = StockfishAnalyzer.get_centipawns
+    processor = GameProcessor(analyzer, MagicMock(), MagicMock(), 150)
+    positions = [chess.Board()]
+    for uci in ['f2f3', 'e7e5', 'g2g4']:
+        positions.append(positions[-1].copy())
+        positions[-1].push_uci(uci)
+    evaluations = [
+        {'type': 'cp', 'value': 20},
+        {'type': 'cp', 'value': -40},
+        {'type': 'cp', 'value': -30},
+        {'type': 'mate', 'value': -1},
+    ]
+
+    # 2. ACT
+    drops = processor._get_eval_drops(positions, evaluations)
+
+    # 3. ASSERT
+    assert drops == [60, 10, 29970]
+    assert analyzer.get_centipawns.call_count == len(evaluations)
+
+
+def test_cached_analyzer_answers_repeated_positions_from_memory():
+    """
+    Tests that positions already looked up by the cache are answered from memory
+    without another database query, unless a deeper search is requested.
+    """
+    # 1. ARRANGE
+    inner = create_autospec(StockfishAnalyzer, instance=True)
+    inner.depth = 18
+    inner.nodes = None
+    inner.engine_name = "Stockfish Test"
+    inner.evaluate_positions.side_effect = lambda boards, depth: [{'type': 'cp', 'value': 5}] * len(boards)
+    db = MagicMock()
+    db.get_cached_evaluation.return_value = None
+    board = chess.Board()
+
+    # 2. ACT
+    analyzer = CachedAnalyzer(inner, db)
+    analyzer.evaluate_positions([board])
+    analyzer.evaluate_positions([board.copy()], depth=12)
+    analyzer.evaluate_positions([board], depth=20)
+
+    # 3. ASSERT
+    assert db.get_cached_evaluation.call_count == 2
+    assert [c.args[2] for c in db.get_cached_evaluation.call_args_list] == [18, 20]
+
+
+def test_cached_analyzer_memo_drops_the_least_recently_used_position():
+    """
+    Tests that a full memo drops the position used least recently rather than
+    forgetting everything.
+    """
+    # 1. ARRANGE
+    inner = create_autospec(StockfishAnalyzer, instance=True)
+    inner.depth = 18
+    inner.nodes = None
+    inner.engine_name = "Stockfish Test"
+    inner.evaluate_positions.side_effect = lambda boards, depth: [{'type': 'cp', 'value': 5}] * len(boards)
+    db = MagicMock()
+    db.get_cached_evaluation.return_value = None
+    start, e4, d4 = chess.Board(), chess.Board(), chess.Board()
+    e4.push_uci('e2e4')
+    d4.push_uci('d2d4')
+
+    # 2. ACT
+    analyzer = CachedAnalyzer(inner, db)
+    analyzer.MEMO_SIZE = 2
+    analyzer.evaluate_positions([start, e4])
+    analyzer.evaluate_positions([start])  # The start position is now the most recently used
+    analyzer.evaluate_positions([d4])     # The memo is full, so 1. e4 is dropped
+    db.get_cached_evaluation.reset_mock()
+    analyzer.evaluate_positions([start, e4, d4])
+
+    # 3. ASSERT
+    assert [c.args[0] for c in db.get_cached_evaluation.call_args_list] == [chess.polyglot.zobrist_hash(e4)]
+
+
+def test_json_is_extracted_from_surrounding_prose(mock_ollama_chat):
+    """
+    Tests that the JSON object is extracted when the LLM surrounds it with prose.
+    """
+    # 1. ARRANGE
+    mock_ollama_chat.return_value = _PROSE_RESPONSE
+
+    # 2. ACT
+    coach = LLMCoach(model="test_model", system_prompt_path=SYSTEM_PROMPT_PATH)
+    analysis = coach.get_analysis(position_fen="test_fen", move_san="e4",
+                                  best_move_san="e5", cp_loss=300, mate_missed=False)
+
+    # 3. ASSERT
+    assert analysis == FORK_FEEDBACK
+
+
+def test_coach_caps_concurrent_llm_requests(mock_ollama_chat):
+    """
+    Tests that a shared coach never has more requests in flight to Ollama than
+    its configured parallelism, even when several games are coached at once and
+    the model is still being warmed up.
+    """
+    # 1. ARRANGE
+    lock = threading.Lock()
+    in_flight = []
+    peak = []
+
+    def chat(**kwargs):
+        with lock:
+            in_flight.append(1)
+            peak.append(len(in_flight))
+        threading.Event().wait(0.05)
+        with lock:
+            in_flight.pop()
+        return _FORK_RESPONSE
+    mock_ollama_chat.side_effect = chat
+
+    coach = LLMCoach(model="test_model", system_prompt_path=SYSTEM_PROMPT_PATH, max_parallel=2)
+    coach._load_system_prompt()
+
+    # 2. ACT
+    threads = [threading.Thread(target=coach.get_analysis,
+                                kwargs=dict(position_fen="test_fen", move_san="e4", best_move_san="e5",
+                                            cp_loss=300, mate_missed=False))
+               for _ in range(5)]
+    threads.append(threading.Thread(target=coach.warm_up))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # 3. ASSERT
+    assert mock_ollama_chat.call_count == 6
+    assert max(peak) == 2
+
+
+def test_coach_warm_up_loads_the_model(mock_ollama_chat):
+    """
+    Tests that warming up the coach sends the system prompt with the options of
+    the coaching requests, and that an unreachable server is not an error at
+    that point.
+    """
+    # 1. ARRANGE
+    mock_ollama_chat.side_effect = ConnectionError("Ollama is not running")
+    coach = LLMCoach(model="test_model", system_prompt_path=SYSTEM_PROMPT_PATH)
+
+    # 2. ACT
+    coach.warm_up()
+    coach.get_analysis(position_fen="test_fen", move_san="e4", best_move_san="e5",
+                       cp_loss=300, mate_missed=False)
+
+    # 3. ASSERT
+    warm_up, request = [c.kwargs for c in mock_ollama_chat.call_args_list]
+    assert warm_up['model'] == "test_model"
+    assert warm_up['messages'][0] == request['messages'][0]
+    assert warm_up['options']['num_ctx'] == request['options']['num_ctx']
+    assert warm_up['options']['num_predict'] == 1
+
+
+def test_cached_analyzer_searches_repeated_positions_once():
+    """
+    Tests that a position reached twice in the same batch, as in a repetition,
+    is only searched once, and that positions are searched without the moves
+    that led to them, so no repetition score ends up in the cache.
+    """
+    # 1. ARRANGE
+    inner = create_autospec(StockfishAnalyzer, instance=True)
+    inner.depth = 18
+    inner.nodes = None
+    inner.engine_name = "Stockfish Test"
+    inner.evaluate_positions.side_effect = lambda boards, depth: [
+        {'type': 'cp', 'value': board.ply()} for board in boards]
+    db = MagicMock()
+    db.get_cached_evaluation.return_value = None
+    boards = [chess.Board()]
+    for uci in ['g1f3', 'g8f6', 'f3g1', 'f6g8']:
+        boards.append(boards[-1].copy())
+        boards[-1].push_uci(uci)
+
+    # 2. ACT
+    evaluations = CachedAnalyzer(inner, db).evaluate_positions(boards)
+
+    # 3. ASSERT
+    searched = inner.evaluate_positions.call_args[0][0]
+    assert [board.ply() for board in searched] == [0, 1, 2, 3]
+    assert all(not board.move_stack for board in searched)
+    assert [e['value'] for e in evaluations] == [0, 1, 2, 3, 0]
+    assert len(db.save_cached_evaluations.call_args[0][3]) == 4
+
+
+@patch('coach.Database')
+@patch('coach.GameProcessor')
+@patch('coach.LLMCoach')
+@patch('coach.StockfishPool')
+def test_pgn_strings_share_one_engine_pool(mock_stockfish_pool, mock_llm_coach, mock_game_processor, mock_database):
+    """
+    Tests that analyze_pgn_string starts the Stockfish pool once and reuses it
+    for later calls instead of spawning new engine processes per game.
+    """
+    # 1. ARRANGE
+    import coach
+    coach._shared_engines = None
+
+    try:
+        # 2. ACT
+        coach.analyze_pgn_string("1. e4 e5 *")
+        coach.analyze_pgn_string("1. d4 d5 *")
+
+        # 3. ASSERT
+        mock_stockfish_pool.assert_called_once()
+        mock_llm_coach.assert_called_once()
+        assert mock_game_processor.call_count == 2
+        mock_stockfish_pool.return_value.close.assert_not_called()
+        assert mock_database.return_value.close.call_count == 2
+    finally:
+        coach._shared_engines = None
+
+
+def test_cached_coach_only_asks_the_llm_once_per_mistake(db):
+    """
+    Tests that coach feedback is persisted and reused for the same mistake, even
+    when it loses a different number of centipawns, and that failed requests are
+    not cached.
+    """
+    # 1. ARRANGE
+    inner = MagicMock()
+    inner.model = "test_model"
+    inner.get_analysis.side_effect = [
+        ("Error", "Error", "Error getting analysis from Ollama: timeout"),
+        ("Fork", "Blunder", "The knight forks king and queen."),
+    ]
+    mistake = dict(position_fen="test_fen", move_san="Nf6", best_move_san="g6", cp_loss=300, mate_missed=False)
+
+    # 2. ACT
+    coach = CachedCoach(inner, db)
+    failed = coach.get_analysis(**mistake)
+    first = coach.get_analysis(**mistake)
+    second = CachedCoach(inner, db).get_analysis(**dict(mistake, cp_loss=320))
+
+    # 3. ASSERT
+    assert failed[1] == "Error"
+    assert first == second == ("Fork", "Blunder", "The knight forks king and queen.")
+    assert inner.get_analysis.call_count == 2
+
+
+@patch('coach.Database')
+@patch('coach.GameProcessor')
+@patch('coach.LLMCoach')
+@patch('coach.StockfishPool')
+def test_cli_analyzes_several_files_on_the_same_engines(mock_stockfish_pool, mock_llm_coach,
+                                                        mock_game_processor, mock_database, tmp_path):
+    """
+    Tests that the CLI analyzes every given file and the PGN files of a given
+    directory with a single processor, and closes the engines once.
+    """
+    # 1. ARRANGE
+    import coach
+    for name in ('b.pgn', 'a.pgn', 'notes.txt'):
+        (tmp_path / name).touch()
+    pgn_dir = str(tmp_path)
+    argv = ['coach.py', TEST_PGN_PATH, pgn_dir]
+
+    # 2. ACT
+    with patch.object(sys, 'argv', argv):
+        coach.main()
+
+    # 3. ASSERT
+    mock_stockfish_pool.assert_called_once()
+    mock_game_processor.assert_called_once()
+    analyzed = [c.args[0] for c in mock_game_processor.return_value.analyze_game.call_args_list]
+    assert analyzed == [TEST_PGN_PATH, os.path.join(pgn_dir, 'a.pgn'), os.path.join(pgn_dir, 'b.pgn')]
+    mock_stockfish_pool.return_value.close.assert_called_once()
@@ -5,88 +5,68 @@ This directly triggers the blunder detection logic to verify side filtering work
 import pytest
 import chess
 import chess.pgn
-from unittest.mock import patch, MagicMock
-from core.analysis import GameProcessor
+from unittest.mock import MagicMock, create_autospec
+from core.analysis import StockfishAnalyzer, GameProcessor
 
-@pytest.mark.parametrize("side_to_analyze, expected_calls", [
-    ("white", 1),  # Only White blunders should be handled
-    ("black", 1),  # Only Black blunders should be handled 
-    ("both", 2),   # Both White and Black blunders should be handled
+@pytest.fixture(scope="module")
+def processor():
+    """One processor for every case; only its blunder handling is exercised."""
+    mock_analyzer = create_autospec(StockfishAnalyzer, instance=True)
+    mock_coach = MagicMock()
+    mock_coach.get_analysis.return_value = ("Missed Tactic", "Medium", "You missed a better move")
+    mock_db = MagicMock()
+    return GameProcessor(mock_analyzer, mock_coach, mock_db, 50)
+
+@pytest.fixture
+def mock_handle_blunder(monkeypatch):
+    """Replaces GameProcessor._handle_blunder with a mock that tracks its calls."""
+    handle_blunder = MagicMock()
+    monkeypatch.setattr(GameProcessor, '_handle_blunder', handle_blunder)
+    return handle_blunder
+
+# A dummy game and node, and one blunder per side; _handle_blunder is mocked, so they are never modified
+_DUMMY_GAME = chess.pgn.Game()
+_DUMMY_NODE = _DUMMY_GAME.add_variation(chess.Move.from_uci("e2e4"))
+WHITE_BLUNDER = {
+    'move_number': 1,
+    'player_color': "White",
+    'move_san': "e4",
+    'position_fen': "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1",
+    'eval_drop': 200,
+    'best_move_san': "d4",
+    'motif': "Missed Tactic",
+    'severity': "Medium",
+    'explanation': "You missed a better move"
+}
+BLACK_BLUNDER = {
+    'move_number': 1,
+    'player_color': "Black",
+    'move_san': "e5",
+    'position_fen': "rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2",
+    'eval_drop': 200,
+    'best_move_san': "c5",
+    'motif': "Missed Tactic",
+    'severity': "Medium",
+    'explanation': "You missed a better move"
+}
+
+# The blunders reported for each side_to_analyze
+BLUNDERS_BY_SIDE = {'white': [WHITE_BLUNDER], 'black': [BLACK_BLUNDER], 'both': [WHITE_BLUNDER, BLACK_BLUNDER]}
+
+@pytest.mark.parametrize("side_to_analyze, expected_colors", [
+    ("white", ["White"]),           # Only White blunders should be handled
+    ("black", ["Black"]),           # Only Black blunders should be handled
+    ("both", ["White", "Black"]),   # Both White and Black blunders should be handled
 ])
-def test_direct_side_specific_analysis(side_to_analyze, expected_calls, capsys):
+def test_direct_side_specific_analysis(processor, mock_handle_blunder, side_to_analyze, expected_colors):
     """
     Tests side-specific analysis by directly triggering the blunder detection
     and verifying the correct blunders are detected based on side_to_analyze.
     """
-    # 1. ARRANGE
-    mock_analyzer = MagicMock()
-    mock_coach = MagicMock()
-    mock_coach.get_analysis.return_value = ("Missed Tactic", "Medium", "You missed a better move")
-    mock_db = MagicMock()
-    
-    processor = GameProcessor(mock_analyzer, mock_coach, mock_db, 50)
+    # 2. ACT - Route the side's blunders straight to the handler
+    for blunder in BLUNDERS_BY_SIDE[side_to_analyze]:
+        processor._handle_blunder(blunder, _DUMMY_NODE, "dummy.pgn")
     
-    # Mock _handle_blunder to track calls
-    with patch.object(GameProcessor, '_handle_blunder') as mock_handle_blunder:
-        # Keep the original analyze_game method
-        original_analyze_game = GameProcessor.analyze_game
-        
-        # Create a patched version that directly triggers blunder detection
-        def patched_analyze_game(self, pgn_path, side_to_analyze='both'):
-            # Create a dummy game and node for testing
-            game = chess.pgn.Game()
-            node = game.add_variation(chess.Move.from_uci("e2e4"))
-            
-            # White's blunder
-            if side_to_analyze == 'both' or side_to_analyze == 'white':
-                white_blunder = {
-                    'move_number': 1,
-                    'player_color': "White",
-                    'move_san': "e4",
-                    'position_fen': "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1",
-                    'eval_drop': 200,
-                    'best_move_san': "d4",
-                    'motif': "Missed Tactic",
-                    'severity': "Medium",
-                    'explanation': "You missed a better move"
-                }
-                print(f"Triggering White blunder with side_to_analyze={side_to_analyze}")
-                self._handle_blunder(white_blunder, node, "dummy.pgn")
-            
-            # Black's blunder
-            if side_to_analyze == 'both' or side_to_analyze == 'black':
-                black_blunder = {
-                    'move_number': 1,
-                    'player_color': "Black",
-                    'move_san': "e5",
-                    'position_fen': "rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2",
-                    'eval_drop': 200,
-                    'best_move_san': "c5",
-                    'motif': "Missed Tactic",
-                    'severity': "Medium",
-                    'explanation': "You missed a better move"
-                }
-                print(f"Triggering Black blunder with side_to_analyze={side_to_analyze}")
-                self._handle_blunder(black_blunder, node, "dummy.pgn")
-            
-            print("\nAnalysis complete.")
-            return game
-        
-        # Replace analyze_game for the test
-        with patch.object(GameProcessor, 'analyze_game', patched_analyze_game):
-            # 2. ACT
-            processor.analyze_game("dummy.pgn", side_to_analyze=side_to_analyze)
-            
-            # 3. ASSERT
-            assert mock_handle_blunder.call_count == expected_calls, \
-                f"Expected {expected_calls} blunder handler calls, got {mock_handle_blunder.call_count}"
-            
-            # Check console output
-            captured = capsys.readouterr()
-            output = captured.out
-            
-            if side_to_analyze == 'white' or side_to_analyze == 'both':
-                assert "Triggering White blunder" in output, "White blunder not detected"
-            
-            if side_to_analyze == 'black' or side_to_analyze == 'both':
-                assert "Triggering Black blunder" in output, "Black blunder not detected"
+    # 3. ASSERT - The handled blunders are read straight from the handler's call log
+    handled_colors = [c.args[0]['player_color'] for c in mock_handle_blunder.call_args_list]
+    assert handled_colors == expected_colors, f"Expected blunders by {expected_colors}, got {handled_colors}"